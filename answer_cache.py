@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import adispatch_custom_event, dispatch_custom_event
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from settings import SIMILARITY_THRESHOLD
+
+TTL_SECONDS = 3600
+MAX_ENTRIES = 1000
+# Custom callback event sent when a turn bypasses the cache
+ANSWER_CACHE_SKIPPED_EVENT = "answer_cache_skipped"
+
+
+@dataclass
+class _Entry:
+    doc_set: str
+    chunk_ids: FrozenSet[str]
+    vector: np.ndarray
+    answer: str
+    created: float
+
+
+def chunk_ids(documents: List[Document]) -> FrozenSet[str]:
+    return frozenset(doc.metadata.get("chunk_id") or doc.id or doc.page_content for doc in documents)
+
+
+class SemanticAnswerCache:
+    """Answers keyed by document set, retrieved chunks and question embedding.
+
+    A lookup hits when an entry for the same document set and the same
+    retrieved chunks has a question vector within ``threshold`` cosine
+    similarity. Entries expire after ``ttl`` seconds and the least recently
+    used ones are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, doc_set: str, ids: FrozenSet[str], vector: List[float], threshold: Optional[float] = None) -> Optional[str]:
+        threshold = self.threshold if threshold is None else threshold
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire(time.time())
+            best_key, best_score = None, threshold
+            for key, entry in self._entries.items():
+                if entry.doc_set != doc_set or entry.chunk_ids != ids:
+                    continue
+                score = float(np.dot(entry.vector, query))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].answer
+
+    def store(self, doc_set: str, ids: FrozenSet[str], vector: List[float], answer: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[(doc_set, ids, now)] = _Entry(doc_set, ids, self._normalize(vector), answer, now)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+answer_cache = SemanticAnswerCache()
+
+
+def cached_answer_chain(
+    question_answer_chain: Runnable,
+    embeddings: Embeddings,
+    doc_set: str,
+    threshold: Optional[float] = None,
+    cache: SemanticAnswerCache = answer_cache,
+) -> Runnable:
+    """Wrap a stuff-documents chain so repeated questions over the same chunks skip the LLM.
+
+    Misses stream straight through from ``question_answer_chain`` and are
+    stored once the full answer is known. Only turns without chat history
+    use the cache: the question is then the one retrieval searched with,
+    while a follow-up's meaning depends on the history the key leaves out.
+    Those turns are reported to callbacks as an ``ANSWER_CACHE_SKIPPED_EVENT``.
+    The question is embedded with ``embeddings.embed_query``; pass the same
+    ``BatchedEmbeddings`` retrieval uses so the lookup reuses its vector.
+    """
+
+    def answer(inputs: dict, config: RunnableConfig):
+        if inputs.get("chat_history"):
+            dispatch_custom_event(ANSWER_CACHE_SKIPPED_EVENT, {}, config=config)
+            yield from question_answer_chain.stream(inputs, config=config)
+            return
+        ids = chunk_ids(inputs["context"])
+        vector = embeddings.embed_query(inputs["input"])
+        hit = cache.lookup(doc_set, ids, vector, threshold)
+        if hit is not None:
+            yield hit
+            return
+        text = ""
+        for token in question_answer_chain.stream(inputs, config=config):
+            text += token
+            yield token
+        cache.store(doc_set, ids, vector, text)
+
+    async def aanswer(inputs: dict, config: RunnableConfig):
+        if inputs.get("chat_history"):
+            await adispatch_custom_event(ANSWER_CACHE_SKIPPED_EVENT, {}, config=config)
+            async for token in question_answer_chain.astream(inputs, config=config):
+                yield token
+            return
+        ids = chunk_ids(inputs["context"])
+        vector = await embeddings.aembed_query(inputs["input"])
+        hit = cache.lookup(doc_set, ids, vector, threshold)
+        if hit is not None:
+            yield hit
+            return
+        text = ""
+        async for token in question_answer_chain.astream(inputs, config=config):
+            text += token
+            yield token
+        cache.store(doc_set, ids, vector, text)
+
+    return RunnableLambda(answer, afunc=aanswer, name="cached_answer")
@@ -1,18 +1,27 @@
 import streamlit as st
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_chroma import Chroma
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_groq import ChatGroq
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
 from dotenv import load_dotenv
 import os
-import tempfile
+import time
+import uuid
+
+# Only settings and the cold-start helpers load up front; LangChain, Chroma,
+# FAISS and the models are imported when the chat pipeline is first needed
+import startup
+from settings import (
+    BACKENDS,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    CONTEXT_TOKEN_BUDGET,
+    DEFAULT_BACKEND,
+    EMBEDDING_MODEL,
+    HIERARCHY_DOCUMENTS,
+    HIERARCHY_SECTIONS,
+    HISTORY_TOKEN_WINDOW,
+    MAX_WORKERS,
+    RETRIEVAL_K,
+    SIMILARITY_THRESHOLD,
+    available_backends,
+)
 
 # Load environment
 load_dotenv()
@@ -233,14 +242,29 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Session Store
-if 'store' not in st.session_state:
-    st.session_state.store = {}
-
-def get_session_history(session: str) -> BaseChatMessageHistory:
-    if session not in st.session_state.store:
-        st.session_state.store[session] = ChatMessageHistory()
-    return st.session_state.store[session]
+# Session Store (SQLite, shared by every app process on this host)
+MAX_TURN_METRICS = 50
+if 'turn_metrics' not in st.session_state:
+    st.session_state.turn_metrics = []
+if 'turn_traces' not in st.session_state:
+    st.session_state.turn_traces = []
+# Kept in the page URL, so a reload or a bookmarked link reopens the same
+# conversation and document workspace; anyone without the link cannot reach them
+if 'session' not in st.query_params:
+    st.query_params['session'] = uuid.uuid4().hex
+
+# Set once the LLM is available when rolling summaries are enabled
+history_summarizer = None
+
+def get_session_history(session: str):
+    from memory import WindowedChatHistory
+    from session_store import SQLiteChatMessageHistory
+    
+    return WindowedChatHistory(
+        SQLiteChatMessageHistory(session),
+        max_tokens=history_token_window,
+        summarizer=history_summarizer
+    )
 
 # Header with Developer Information
 st.markdown("""
@@ -292,14 +316,93 @@ with st.sidebar:
             accept_multiple_files=True,
             help="Upload one or more PDF documents for analysis"
         )
+        extraction_workers = st.slider(
+            "Parallel Extraction Workers",
+            min_value=1,
+            max_value=MAX_WORKERS,
+            value=MAX_WORKERS,
+            help="Number of processes used to parse PDFs; large documents are split into page ranges"
+        ) if MAX_WORKERS > 1 else 1
+    
+    with st.expander("🔍 Retrieval Settings", expanded=False):
+        context_token_budget = st.slider(
+            "Context Token Budget",
+            min_value=500,
+            max_value=6000,
+            value=CONTEXT_TOKEN_BUDGET,
+            step=250,
+            help="Maximum tokens of retrieved document text sent to the LLM per question"
+        )
+        answer_cache_threshold = st.slider(
+            "Answer Cache Similarity",
+            min_value=0.80,
+            max_value=1.00,
+            value=SIMILARITY_THRESHOLD,
+            step=0.01,
+            help="Reuse a previous answer when a question this similar was asked about the same passages"
+        )
+        backends = available_backends()
+        vector_backend = st.selectbox(
+            "Vector Search Backend",
+            backends,
+            index=backends.index(DEFAULT_BACKEND) if DEFAULT_BACKEND in backends else 0,
+            format_func=BACKENDS.get,
+            help="FAISS indexes are built from the stored vectors and memory-mapped; HNSW and IVF trade a little recall for speed and size"
+        )
+        retrieval_k = st.slider(
+            "Chunks per Question",
+            min_value=1,
+            max_value=10,
+            value=RETRIEVAL_K,
+            help="Document chunks retrieved for each question"
+        )
+        hierarchical_retrieval = st.checkbox(
+            "Hierarchical Retrieval",
+            value=False,
+            help="Pick the closest documents, then the closest sections within them, and search only their chunks (uses Chroma)"
+        )
+        if hierarchical_retrieval:
+            coarse_documents = st.slider(
+                "Candidate Documents",
+                min_value=1,
+                max_value=50,
+                value=HIERARCHY_DOCUMENTS,
+                help="Documents kept by the first, coarse stage"
+            )
+            coarse_sections = st.slider(
+                "Candidate Sections",
+                min_value=1,
+                max_value=50,
+                value=HIERARCHY_SECTIONS,
+                help="Sections of those documents whose chunks are searched"
+            )
     
     with st.expander("⚙️ Session Settings", expanded=True):
-        session_id = st.text_input("Session ID", value="default", help="Maintain conversation history across sessions")
+        session_id = st.text_input(
+            "Session ID",
+            value=st.query_params['session'],
+            help="Kept in the page URL; open the same link or enter the same ID elsewhere to share the conversation"
+        ).strip() or st.query_params['session']
+        st.query_params['session'] = session_id
         user_name = st.text_input("Your Name", value="Analyst", help="For personalizing your experience")
+        stream_responses = st.checkbox("Stream Responses", value=True, help="Show the answer as it is generated")
+        history_token_window = st.slider(
+            "History Token Window",
+            min_value=250,
+            max_value=4000,
+            value=HISTORY_TOKEN_WINDOW,
+            step=250,
+            help="Most recent conversation tokens replayed to the LLM each turn"
+        )
+        summarize_history = st.checkbox(
+            "Summarize Older Turns",
+            value=False,
+            help="Fold turns that leave the window into a rolling summary (uses extra LLM calls)"
+        )
         
         if st.button("🔄 Reset Session", type="secondary"):
-            if 'store' in st.session_state and session_id in st.session_state.store:
-                del st.session_state.store[session_id]
+            from session_store import SQLiteChatMessageHistory
+            SQLiteChatMessageHistory(session_id).clear()
             st.success("Session history cleared!")
     
     st.markdown("---")
@@ -312,6 +415,9 @@ with st.sidebar:
         </div>
     """, unsafe_allow_html=True)
 
+# Set by the chat tab once documents are indexed; the Advanced tab reports on them
+index = summaries = backend_report = None
+
 # Main Content Tabs
 tab1, tab2, tab3 = st.tabs(["📋 Dashboard", "💬 Document Chat", "⚙️ Advanced"])
 
@@ -371,6 +477,10 @@ with tab1:
             </div>
         """, unsafe_allow_html=True)
 
+# The Dashboard is on screen; load the chat pipeline while the user reads it
+if startup.PREWARM:
+    startup.prewarm()
+
 with tab2:
     st.markdown("## Document Conversation Interface")
     
@@ -382,91 +492,184 @@ with tab2:
         st.info("📁 Please upload PDF documents in the sidebar to begin analysis.")
         st.stop()
     
+    # Heavy imports, usually already done by the pre-warm thread
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    
+    from chat import invoke_answer, stream_answer
+    from engine import build_rag_chain
+    from faiss_index import current_report, ensure_index, get_retriever
+    from hierarchy import SECTION_PAGES, document_filter, get_retriever as get_hierarchical_retriever, update_summaries
+    from index_manager import IndexManager, document_set_hash
+    from ingestion import content_hash, ingest_files, stream_file
+    from jobs import CANCELLED, DONE, FAILED, job_manager
+    from memory import build_summarizer
+    from resources import get_embeddings, get_llm
+    from tracing import TurnTracer, serve_metrics
+    from transcript import TRANSCRIPT_TURNS, escape_content, message_block, transcript_renderer
+    from vector_store import TOUCH_SECONDS, prune_collections, touch_collection, workspace_collection
+    
+    # Prometheus scrape endpoint, started once per process
+    metrics_port = serve_metrics()
+    
     # Initialize components
     with st.spinner("Initializing document processing..."):
-        # Create temporary files
-        temp_files = []
-        for uploaded_file in uploaded_files:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                temp_file.write(uploaded_file.getvalue())
-                temp_files.append(temp_file.name)
-        
-        # Process documents
-        documents = []
-        for temp_path in temp_files:
-            try:
-                loader = PyPDFLoader(temp_path)
-                docs = loader.load()
-                documents.extend(docs)
-            except Exception as e:
-                st.error(f"Error processing file {temp_path}: {str(e)}")
-            finally:
-                os.unlink(temp_path)
+        embeddings = get_embeddings(EMBEDDING_MODEL)
         
-        if not documents:
-            st.error("No valid documents could be processed. Please check your PDF files.")
-            st.stop()
-        
-        # Split and embed documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=5000,
-            chunk_overlap=500,
-            length_function=len,
-            is_separator_regex=False
+        # Keep this session's index in sync with the uploads: only new files are
+        # parsed and embedded, and chunks of removed files are deleted
+        index = IndexManager(
+            workspace_collection(session_id, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL),
+            embeddings
         )
-        splits = text_splitter.split_documents(documents)
+        # Marked as in use every few minutes while the session is active, not on every rerun
+        touched = st.session_state.get('touched_collection')
+        if touched is None or touched[0] != index.name or time.time() - touched[1] > TOUCH_SECONDS:
+            touch_collection(index.name)
+            st.session_state.touched_collection = (index.name, time.time())
+        uploads = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+        upload_hashes = [content_hash(data) for _, data in uploads]
+        job_key = f"{index.name}:{document_set_hash(upload_hashes)}"
         
-        # Initialize vector store
-        embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Indexing runs as a background job so reruns poll it instead of restarting it
+        def run_sync(job, workers=extraction_workers):
+            def report_progress(done, total, name):
+                job.report(done / total, f"Parsed {name} ({done}/{total})")
+            
+            def ingest(files):
+                ingested = ingest_files(
+                    files,
+                    embeddings,
+                    model_name=EMBEDDING_MODEL,
+                    chunk_size=CHUNK_SIZE,
+                    chunk_overlap=CHUNK_OVERLAP,
+                    max_workers=workers,
+                    on_progress=report_progress
+                )
+                job.check()
+                return ingested
+            
+            # Very long PDFs are parsed, embedded and stored in bounded batches
+            def stream(name, data):
+                return stream_file(
+                    name,
+                    data,
+                    embeddings,
+                    chunk_size=CHUNK_SIZE,
+                    chunk_overlap=CHUNK_OVERLAP,
+                    max_workers=workers,
+                    on_progress=report_progress
+                )
+            
+            index_delta, failed_files = index.sync(uploads, ingest, stream)
+            prune_collections(in_use=job_manager.active_groups())
+            return index_delta, failed_files, index.document_set
         
-        vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=embeddings,
-            persist_directory="./chroma_db"
-        )
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+        # A finished job is reused, so failed files are not retried on every
+        # rerun, unless the index has changed since it ran
+        job = job_manager.latest(job_key)
+        stale = job is not None and job.state == DONE and job.result[2] != index.document_set
+        if (job is None or stale) and index.diff(upload_hashes).changed:
+            job = job_manager.submit(job_key, run_sync, group=index.name)
     
-    # Initialize LLM and conversation chain
-    llm = ChatGroq(
-        groq_api_key=api_key,
-        model_name="Llama3-8b-8192",
-        temperature=0.3
-    )
-    
-    # Define prompts
-    contextualize_prompt = ChatPromptTemplate.from_messages([
-        ("system", """Given a chat history and the latest user question which might reference context in the chat history, rephrase the question to be a standalone question that contains all the needed context. Return the standalone question verbatim. Do not answer the question."""),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}")
-    ])
-    
-    qa_system_prompt = """You are an expert document analyst. Use the following pieces of retrieved context to answer the question.
-    If you don't know the answer, just say that you don't know. Be precise and professional in your responses.
+    indexed_files = index.files
+    if job is not None and job.active:
+        st.markdown("### Indexing Documents")
+        
+        @st.fragment(run_every=1.0)
+        def indexing_progress():
+            if not job.active:
+                st.rerun()
+            st.progress(job.progress, text=job.message or "Waiting for a free worker...")
+        
+        indexing_progress()
+        if st.button("⏹️ Cancel Indexing", type="secondary"):
+            job_manager.cancel(job.id)
+            st.rerun()
+        # While a sync updates an existing index, questions search the files indexed so far
+        if not indexed_files:
+            st.chat_input("Questions are enabled once the documents are indexed...", disabled=True)
+            st.stop()
     
-    {context}"""
+    if job is not None and job.state == CANCELLED:
+        st.warning("⚠️ Indexing was cancelled.")
+        if st.button("🔁 Restart Indexing"):
+            job_manager.submit(job_key, run_sync, group=index.name)
+            st.rerun()
+    elif job is not None and job.state == FAILED:
+        st.error(f"Indexing failed: {job.error}")
+        if st.button("🔁 Retry Indexing"):
+            job_manager.submit(job_key, run_sync, group=index.name)
+            st.rerun()
+    elif job is not None and job.state == DONE:
+        for file_name, e in job.result[1]:
+            st.error(f"Error processing file {file_name}: {str(e)}")
     
-    qa_prompt = ChatPromptTemplate.from_messages([
-        ("system", qa_system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}")
-    ])
+    if not indexed_files:
+        st.error("No valid documents could be processed. Please check your PDF files.")
+        st.stop()
     
-    # Create chains
-    history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, contextualize_prompt
+    # Chat interface
+    st.markdown("### Document Conversation")
+    selected_documents = st.multiselect(
+        "Search Only In",
+        options=list(indexed_files),
+        format_func=lambda file_hash: indexed_files[file_hash]["name"],
+        placeholder="All documents",
+        help="Limit retrieval to some of the indexed documents"
     )
     
-    question_answer_chain = create_stuff_documents_chain(
-        llm, qa_prompt
-    )
+    with st.spinner("Initializing document processing..."):
+        document_set = index.document_set
+        vectorstore = index.vectorstore
+        if hierarchical_retrieval:
+            retriever, summaries = get_hierarchical_retriever(
+                vectorstore, embeddings, index.name, indexed_files,
+                documents=coarse_documents, sections=coarse_sections, k=retrieval_k, only=selected_documents
+            )
+        elif selected_documents:
+            # Derived FAISS indexes cover every document, so filtered searches go to Chroma.
+            # Bringing the summaries up to date also gives chunks stored by older
+            # versions the section fields the filter matches on.
+            update_summaries(vectorstore, index.name, indexed_files)
+            retriever = vectorstore.as_retriever(
+                search_kwargs={"k": retrieval_k, "filter": document_filter(selected_documents)}
+            )
+        else:
+            # FAISS indexes are built, and Chroma's measured, by a background job;
+            # questions are answered from Chroma until the index is ready
+            backend_report = current_report(index.name, vector_backend, document_set)
+            if backend_report is None and not (job is not None and job.active):
+                build_key = f"{index.name}:{vector_backend}:{document_set}"
+                build_job = job_manager.latest(build_key)
+                if build_job is None:
+                    build_job = job_manager.submit(
+                        build_key, lambda job: ensure_index(vectorstore, index.name, vector_backend, document_set)
+                    )
+                if build_job.state == FAILED:
+                    st.warning(f"Could not build the {BACKENDS[vector_backend]} index, using Chroma: {build_job.error}")
+                elif build_job.state == DONE:
+                    backend_report = build_job.result
+                elif vector_backend != "chroma":
+                    st.info(f"Building the {BACKENDS[vector_backend]} index in the background; searching with Chroma until it is ready.")
+            if backend_report is not None and vector_backend != "chroma":
+                retriever, backend_report = get_retriever(
+                    vectorstore, embeddings, index.name, vector_backend, document_set, k=retrieval_k
+                )
+            else:
+                retriever = vectorstore.as_retriever(search_kwargs={"k": retrieval_k})
+    
+    # Initialize LLM and conversation chain
+    llm = get_llm(api_key)
+    if summarize_history:
+        history_summarizer = build_summarizer(llm)
     
-    rag_chain = create_retrieval_chain(
-        history_aware_retriever,
-        question_answer_chain
+    # Same chain the headless batch engine runs
+    rag_chain = build_rag_chain(
+        llm, vectorstore, embeddings, document_set,
+        k=retrieval_k,
+        context_token_budget=context_token_budget,
+        answer_cache_threshold=answer_cache_threshold,
+        retriever=retriever
     )
     
     conversational_rag_chain = RunnableWithMessageHistory(
@@ -477,78 +680,96 @@ with tab2:
         output_messages_key="answer"
     )
     
-    # Chat interface
-    st.markdown("### Document Conversation")
+    # Display the most recent turns of the chat history; older ones load on demand
+    if 'transcript_turns' not in st.session_state:
+        st.session_state.transcript_turns = {}
+    shown_turns = st.session_state.transcript_turns.get(session_id, TRANSCRIPT_TURNS)
+    
+    def load_older_turns():
+        st.session_state.transcript_turns[session_id] = shown_turns + TRANSCRIPT_TURNS
     
-    # Display chat history
     history = get_session_history(session_id)
-    for msg in history.messages:
-        if msg.type == "human":
-            st.markdown(f"""
-                <div class='chat-message-user'>
-                    <strong>{user_name}</strong><br>
-                    {msg.content}
-                </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-                <div class='chat-message-bot'>
-                    <strong>AI Analyst</strong><br>
-                    {msg.content}
-                </div>
-            """, unsafe_allow_html=True)
+    page, has_older = history.transcript_page(2 * shown_turns)
+    if has_older:
+        st.button("⬆️ Load older messages", on_click=load_older_turns)
+    if page:
+        st.markdown(
+            transcript_renderer.render(page, {"human": user_name, "ai": "AI Analyst"}),
+            unsafe_allow_html=True
+        )
     
     # Chat input
     user_input = st.chat_input(f"Ask {user_name}'s document question...")
     
     if user_input:
         # Add user message to chat
-        st.markdown(f"""
-            <div class='chat-message-user'>
-                <strong>{user_name}</strong><br>
-                {user_input}
-            </div>
-        """, unsafe_allow_html=True)
+        st.markdown(message_block("chat-message-user", user_name, escape_content(user_input)), unsafe_allow_html=True)
         
         # Get and display AI response
-        with st.spinner("Analyzing documents..."):
-            try:
-                response = conversational_rag_chain.invoke(
-                    {"input": user_input},
-                    config={"configurable": {"session_id": session_id}}
+        bot_message = st.empty()
+        
+        def render_answer(text):
+            bot_message.markdown(message_block("chat-message-bot", "AI Analyst", escape_content(text)), unsafe_allow_html=True)
+        
+        try:
+            tracer = TurnTracer(session_id)
+            chain_config = {"configurable": {"session_id": session_id}, "callbacks": [tracer]}
+            if stream_responses:
+                answer, turn_metrics = stream_answer(
+                    conversational_rag_chain, {"input": user_input}, chain_config, render_answer
                 )
-                
-                st.markdown(f"""
-                    <div class='chat-message-bot'>
-                        <strong>AI Analyst</strong><br>
-                        {response['answer']}
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                # Add to session history
-                session_history = get_session_history(session_id)
-                session_history.add_user_message(user_input)
-                session_history.add_ai_message(response["answer"])
-                
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            else:
+                with st.spinner("Analyzing documents..."):
+                    answer, turn_metrics = invoke_answer(
+                        conversational_rag_chain, {"input": user_input}, chain_config
+                    )
+                render_answer(answer)
+            # RunnableWithMessageHistory has already recorded the turn
+            st.session_state.turn_metrics = (st.session_state.turn_metrics + [turn_metrics])[-MAX_TURN_METRICS:]
+            st.session_state.turn_traces = (st.session_state.turn_traces + [tracer.trace])[-MAX_TURN_METRICS:]
+            
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
 
 with tab3:
+    from answer_cache import answer_cache
+    from resources import health
+    from session_store import SQLiteChatMessageHistory
+    
     st.markdown("## Advanced Settings & Information")
     
     col1, col2 = st.columns(2)
     
     with col1:
+        resource_health = health()
+        prewarm_status = startup.status()
         st.markdown("""
             <div class='card feature-card'>
                 <h3 class='card-title'>🛠️ System Configuration</h3>
                 <p><strong>Embedding Model:</strong> all-MiniLM-L6-v2</p>
-                <p><strong>Vector Database:</strong> ChromaDB</p>
+                <p><strong>Vector Database:</strong> {vector_database}</p>
                 <p><strong>LLM Provider:</strong> Groq</p>
                 <p><strong>Chunk Size:</strong> 5000 characters</p>
                 <p><strong>Chunk Overlap:</strong> 500 characters</p>
+                <p><strong>Loaded Models:</strong> {model_count} embedding, {llm_count} LLM client(s)</p>
+                <p><strong>Pipeline Pre-warm:</strong> {prewarm}</p>
+                <p><strong>Metrics Endpoint:</strong> {metrics_endpoint}</p>
             </div>
-        """, unsafe_allow_html=True)
+        """.format(
+            model_count=len(resource_health["embedding_models"]),
+            llm_count=resource_health["llm_clients"],
+            prewarm=(
+                "disabled" if not prewarm_status["started"]
+                else prewarm_status.get("error") or (
+                    f"ready after {prewarm_status['total']:.1f}s" if "total" in prewarm_status else "loading..."
+                )
+            ),
+            metrics_endpoint=f"port {metrics_port}" if metrics_port else "not served",
+            vector_database=(
+                f"ChromaDB + {BACKENDS[backend_report['backend']]}"
+                if backend_report is not None and backend_report["backend"] != "chroma" else "ChromaDB"
+            )
+        ), unsafe_allow_html=True)
     
     with col2:
         st.markdown("""
@@ -558,20 +779,108 @@ with tab3:
                 <p><strong>Total Chunks:</strong> {chunk_count} segments</p>
                 <p><strong>Session History:</strong> {msg_count} messages</p>
                 <p><strong>Vector Store:</strong> Active</p>
+                <p><strong>Last Turn:</strong> {last_turn}</p>
+                <p><strong>Answer Cache:</strong> {cache_hits} hits / {cache_misses} misses</p>
             </div>
         """.format(
             doc_count=len(uploaded_files) if uploaded_files else 0,
-            chunk_count=len(splits) if 'splits' in locals() else 0,
-            msg_count=len(get_session_history(session_id).messages)
+            chunk_count=index.chunk_count if index is not None else 0,
+            msg_count=SQLiteChatMessageHistory(session_id).count(),
+            last_turn=(
+                f"{st.session_state.turn_metrics[-1].time_to_first_token:.2f}s to first token, "
+                f"{st.session_state.turn_metrics[-1].total_time:.2f}s total"
+                if st.session_state.turn_metrics else "No questions yet"
+            ),
+            cache_hits=answer_cache.hits,
+            cache_misses=answer_cache.misses
         ), unsafe_allow_html=True)
     
     st.markdown("""
         <div class='card feature-card'>
             <h3 class='card-title'>🔍 Retrieval Parameters</h3>
-            <p>The system retrieves the 3 most relevant document chunks for each query, using cosine similarity on the embeddings.</p>
+            <p>The system retrieves the {k} most relevant document chunks for each query, using cosine similarity on the embeddings.</p>
             <p>Conversation history is used to provide context for follow-up questions while maintaining relevance to the original documents.</p>
         </div>
-    """, unsafe_allow_html=True)
+    """.format(k=retrieval_k), unsafe_allow_html=True)
+    
+    if summaries is not None:
+        st.markdown("""
+            <div class='card feature-card'>
+                <h3 class='card-title'>🗂️ Hierarchical Index</h3>
+                <p><strong>Summaries:</strong> {documents} documents, {sections} sections of {section_pages} pages</p>
+                <p><strong>Per Question:</strong> best {coarse_documents} documents, then best {coarse_sections} sections, then best {k} chunks</p>
+            </div>
+        """.format(
+            documents=summaries.documents,
+            sections=summaries.section_count,
+            section_pages=SECTION_PAGES,
+            coarse_documents=coarse_documents,
+            coarse_sections=coarse_sections,
+            k=retrieval_k
+        ), unsafe_allow_html=True)
+    
+    if backend_report is not None:
+        st.markdown("""
+            <div class='card feature-card'>
+                <h3 class='card-title'>🧭 Vector Backend</h3>
+                <p><strong>Backend:</strong> {backend} ({factory}{nprobe})</p>
+                <p><strong>Vectors:</strong> {vectors} × {dimensions} dimensions</p>
+                <p><strong>Build Time:</strong> {build_time}</p>
+                <p><strong>Index Size:</strong> {index_mb:.1f} MB {index_kind} ({raw_mb:.1f} MB as raw float32)</p>
+                <p><strong>Recall@{k}:</strong> {recall_at_k:.3f} against exact search</p>
+                <p><strong>Search Latency:</strong> {search_ms_p50:.2f} ms median</p>
+                {fallback_note}
+            </div>
+        """.format(
+            fallback_note=f"<p><strong>Note:</strong> {backend_report['fallback']}</p>" if "fallback" in backend_report else "",
+            backend=BACKENDS[backend_report["backend"]],
+            nprobe=(
+                (f", probing {backend_report['nprobe']} lists" if "nprobe" in backend_report else "")
+                + (f", re-ranking {backend_report['rerank']}× candidates" if "rerank" in backend_report else "")
+            ),
+            build_time=(
+                f"{backend_report['build_seconds']:.2f}s" if backend_report["build_seconds"] is not None
+                else "built incrementally as chunks are stored"
+            ),
+            index_mb=backend_report["index_bytes"] / 1e6,
+            index_kind="estimated in memory" if backend_report["backend"] == "chroma" else "memory-mapped",
+            raw_mb=backend_report["raw_vector_bytes"] / 1e6,
+            **{
+                key: value for key, value in backend_report.items()
+                if key not in ("backend", "fallback", "nprobe", "build_seconds")
+            }
+        ), unsafe_allow_html=True)
+    
+    if st.session_state.turn_traces:
+        trace = st.session_state.turn_traces[-1]
+        stage_rows = []
+        for timing in trace.stages:
+            details = []
+            if timing.chunks is not None:
+                details.append(f"{timing.chunks} chunks")
+            if timing.stage == "llm":
+                details.append(f"{timing.prompt_tokens} prompt / {timing.completion_tokens} completion tokens")
+            if timing.cache is not None:
+                details.append(f"cache {timing.cache}")
+            stage_rows.append(
+                f"<p><strong>{timing.stage}:</strong> {timing.seconds:.3f}s"
+                + (f" ({', '.join(details)})" if details else "") + "</p>"
+            )
+        prompt_tokens, completion_tokens = trace.tokens
+        st.markdown("""
+            <div class='card feature-card'>
+                <h3 class='card-title'>⏱️ Last Turn Breakdown</h3>
+                <p><strong>Total:</strong> {total:.3f}s, {prompt_tokens} prompt / {completion_tokens} completion tokens</p>
+                {stages}
+                <p><strong>Trace ID:</strong> {trace_id}</p>
+            </div>
+        """.format(
+            total=trace.total_seconds,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            stages="".join(stage_rows),
+            trace_id=trace.trace_id
+        ), unsafe_allow_html=True)
 
 # Footer
 st.markdown("""
@@ -0,0 +1,32 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Index files are shared by every session and by other processes, so they are
+# written to a temporary file next to the target and moved into place; readers
+# see either the old file or the new one, never a partial write.
+
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """Yield a temporary path to write instead of ``path``, moved over it once the block succeeds.
+
+    The temporary name keeps the target's extension, as ``np.save`` and
+    ``np.savez`` add theirs when it is missing.
+    """
+    extension = os.path.splitext(path)[1]
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_json(path: str, data: Any) -> None:
+    with atomic_path(path) as temp_path:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
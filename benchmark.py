@@ -0,0 +1,300 @@
+"""Headless benchmark for the PDF Insight Engine ingestion and query pipeline.
+
+Drives the same code as the Document Chat tab over a generated corpus of
+synthetic PDFs: ``IndexManager.sync`` with ``ingest_files`` and
+``stream_file`` behind ``BatchedEmbeddings``, the selected vector backend,
+and ``engine.build_rag_chain`` with its context packer and answer cache.
+Timings go to JSON so runs can be compared over time. Groq is replaced by a
+local stub chat model, so no API key or network access is needed.
+
+The extraction pool is started before the first corpus and reported as its
+own ``warmup`` row. Every stage records the peak RSS of this process and of
+the extraction workers.
+
+    python benchmark.py --pages 10 50 200 --output bench.json
+    python benchmark.py --fake-embeddings   # skip loading the embedding model
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from answer_cache import answer_cache
+from context import CONTEXT_TOKEN_BUDGET
+from embedding_cache import MAX_BATCH_SIZE, BatchedEmbeddings, VectorCache
+from engine import build_rag_chain
+from faiss_index import get_retriever
+from index_manager import IndexManager
+from ingestion import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    EMBEDDING_MODEL,
+    MAX_WORKERS,
+    content_hash,
+    extraction_worker_pids,
+    ingest_files,
+    stream_file,
+    warm_extraction_pool,
+)
+from settings import BACKENDS, DEFAULT_BACKEND
+from tracing import metrics
+from vector_store import collection_name
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_WORDS = (
+    "revenue margin quarter fiscal growth capital liability asset equity dividend "
+    "contract clause party agreement term renewal obligation warranty indemnity "
+    "report analysis forecast segment customer supplier market risk compliance audit "
+    "operating expense income statement balance cash flow investment portfolio"
+).split()
+
+
+def synthetic_pdf(pages: int, seed: int = 0, lines_per_page: int = 45, words_per_line: int = 12) -> bytes:
+    """Build a valid text-only PDF with deterministic pseudo-random content."""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [f"Page {page + 1}"] + [
+            " ".join(rng.choice(_WORDS) for _ in range(words_per_line)) for _ in range(lines_per_page)
+        ]
+        stream = ("BT /F1 10 Tf 40 760 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode("latin-1")
+        page_object = len(objects) + 1
+        kids.append(f"{page_object} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_object + 1} 0 R >>".encode("latin-1")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode("latin-1")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def synthetic_questions(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What does the report say about {rng.choice(_WORDS)} and {rng.choice(_WORDS)}?" for _ in range(count)]
+
+
+def _rss_mb(kilobytes: float) -> float:
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return kilobytes / (1024 * 1024) if sys.platform == "darwin" else kilobytes / 1024
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    return _rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _high_water_mark_kb(pid: int) -> int:
+    """Peak RSS of a running process from /proc, or 0 where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def children_peak_rss_mb() -> float:
+    """Peak RSS of the extraction workers combined.
+
+    Running workers are read from /proc, as RUSAGE_CHILDREN only covers
+    children that have exited; the larger of the two is reported.
+    """
+    running = sum(_high_water_mark_kb(pid) for pid in extraction_worker_pids()) / 1024
+    exited = _rss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) if resource is not None else 0.0
+    return max(running, exited)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if len(ordered) < 2:
+        value = ordered[0] if ordered else 0.0
+        return {"p50": value, "p95": value}
+    cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+    return {"p50": round(cuts[49], 3), "p95": round(cuts[94], 3)}
+
+
+@contextmanager
+def stage(results: dict, name: str):
+    started = time.perf_counter()
+    yield
+    results[name] = {
+        "seconds": round(time.perf_counter() - started, 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "children_peak_rss_mb": round(children_peak_rss_mb(), 1),
+    }
+
+
+def load_embeddings(fake: bool, cache_directory: str) -> BatchedEmbeddings:
+    """The app's embedding stack, with a vector cache that starts empty."""
+    if fake:
+        base, model_name = DeterministicFakeEmbedding(size=384), "fake"
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        base, model_name = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': MAX_BATCH_SIZE}
+        ), EMBEDDING_MODEL
+    return BatchedEmbeddings(base, VectorCache(model_name, cache_directory))
+
+
+def run_size(pages: int, embeddings: BatchedEmbeddings, persist_directory: str, args) -> dict:
+    data = synthetic_pdf(pages, seed=pages)
+    name = f"synthetic-{pages}.pdf"
+    model_name = embeddings.cache.model_name
+    stages: Dict[str, dict] = {}
+
+    index = IndexManager(
+        collection_name([content_hash(data)], args.chunk_size, args.chunk_overlap, model_name),
+        embeddings,
+        persist_directory
+    )
+    spans_before = metrics.stage_seconds()
+    with stage(stages, "sync"):
+        _, errors = index.sync(
+            [(name, data)],
+            lambda files: ingest_files(
+                files, embeddings, model_name=model_name,
+                chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, max_workers=args.workers
+            ),
+            lambda name, data: stream_file(
+                name, data, embeddings,
+                chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, max_workers=args.workers
+            )
+        )
+    if errors:
+        raise RuntimeError(f"Could not index {name}: {errors[0][1]}")
+    # Time spent in each traced ingestion step; streamed files overlap them
+    spans_after = metrics.stage_seconds()
+    sync_spans = {
+        span_name: round(seconds - spans_before.get(span_name, 0.0), 4)
+        for span_name, seconds in spans_after.items() if seconds != spans_before.get(span_name)
+    }
+
+    with stage(stages, "backend"):
+        retriever, _ = get_retriever(
+            index.vectorstore, embeddings, index.name, args.backend, index.document_set,
+            k=args.k, persist_directory=persist_directory
+        )
+
+    questions = synthetic_questions(args.queries)
+    retrieval_ms = []
+    with stage(stages, "retrieve"):
+        for question in questions:
+            started = time.perf_counter()
+            retriever.invoke(question)
+            retrieval_ms.append((time.perf_counter() - started) * 1000)
+
+    llm = FakeListChatModel(responses=["This is a stub answer from the benchmark."])
+    rag_chain = build_rag_chain(
+        llm, index.vectorstore, embeddings, index.document_set,
+        k=args.k, context_token_budget=args.context_token_budget, retriever=retriever
+    )
+    cache_before = answer_cache.stats()
+    answer_ms = []
+    with stage(stages, "answer"):
+        for question in questions:
+            started = time.perf_counter()
+            rag_chain.invoke({"input": question, "chat_history": []})
+            answer_ms.append((time.perf_counter() - started) * 1000)
+    cache_after = answer_cache.stats()
+
+    return {
+        "pages": pages,
+        "file_bytes": len(data),
+        "chunks": index.chunk_count,
+        "stages": stages,
+        "sync_spans": sync_spans,
+        "chunks_per_second": round(index.chunk_count / max(stages["sync"]["seconds"], 1e-9), 1),
+        "retrieval_ms": percentiles(retrieval_ms),
+        "answer_ms": percentiles(answer_ms),
+        "answer_cache_hits": cache_after["hits"] - cache_before["hits"],
+    }
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200], help="corpus sizes in pages")
+    parser.add_argument("--queries", type=int, default=50, help="questions per corpus size")
+    parser.add_argument("--k", type=int, default=3, help="chunks retrieved per question")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="extraction tasks in flight per file")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="vector search backend")
+    parser.add_argument("--context-token-budget", type=int, default=CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--fake-embeddings", action="store_true", help="use deterministic fake vectors")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON report")
+    args = parser.parse_args(argv)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embeddings": "fake" if args.fake_embeddings else EMBEDDING_MODEL,
+        },
+        "settings": {
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "k": args.k,
+            "queries": args.queries,
+            "workers": args.workers,
+            "backend": args.backend,
+            "context_token_budget": args.context_token_budget,
+        },
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as persist_directory:
+        embeddings = load_embeddings(args.fake_embeddings, os.path.join(persist_directory, "embedding_cache"))
+        # Worker start-up is a one-off cost per process, reported apart from the corpora
+        warmup: Dict[str, dict] = {}
+        with stage(warmup, "warmup"):
+            workers = warm_extraction_pool()
+        report["warmup"] = dict(warmup["warmup"], workers=len(workers))
+        print(f"warmup {report['warmup']['seconds']:.3f}s  {len(workers)} extraction workers")
+        for pages in args.pages:
+            run = run_size(pages, embeddings, persist_directory, args)
+            report["runs"].append(run)
+            print(
+                f"{pages:>5} pages  {run['chunks']:>5} chunks  "
+                + "  ".join(f"{name} {values['seconds']:.3f}s" for name, values in run["stages"].items())
+                + f"  retrieve p50 {run['retrieval_ms']['p50']:.1f}ms p95 {run['retrieval_ms']['p95']:.1f}ms"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.callbacks import adispatch_custom_event, dispatch_custom_event
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import BasePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+STREAM_REFRESH_SECONDS = 0.05
+REWRITE_CACHE_SIZE = 512
+REWRITE_HISTORY_MESSAGES = 6
+# Custom callback event sent when a question goes to retrieval without a rewrite
+REWRITE_SKIPPED_EVENT = "rewrite_skipped"
+
+# Words and openings that make a question lean on earlier turns
+_REFERENCE_WORDS = frozenset("""
+    it its it's they them their theirs this that these those he him his she her hers
+    above below previous earlier former latter same such one ones again else
+""".split())
+_FOLLOW_UP_OPENINGS = ("and ", "but ", "also ", "so ", "what about", "how about", "why", "then ")
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+CONTEXTUALIZE_SYSTEM_PROMPT = """Given a chat history and the latest user question which might reference context in the chat history, rephrase the question to be a standalone question that contains all the needed context. Return the standalone question verbatim. Do not answer the question."""
+
+QA_SYSTEM_PROMPT = """You are an expert document analyst. Use the following pieces of retrieved context to answer the question.
+    If you don't know the answer, just say that you don't know. Be precise and professional in your responses.
+    
+    {context}"""
+
+
+def build_prompts() -> Tuple[ChatPromptTemplate, ChatPromptTemplate]:
+    """The question-contextualizing and question-answering prompts used by the chat tab."""
+    contextualize_prompt = ChatPromptTemplate.from_messages([
+        ("system", CONTEXTUALIZE_SYSTEM_PROMPT),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}")
+    ])
+    qa_prompt = ChatPromptTemplate.from_messages([
+        ("system", QA_SYSTEM_PROMPT),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}")
+    ])
+    return contextualize_prompt, qa_prompt
+
+
+@dataclass
+class TurnMetrics:
+    """Timings for one chat turn, in seconds."""
+    time_to_first_token: Optional[float]
+    total_time: float
+    streamed: bool
+    chunks: int = 0
+
+
+def stream_answer(
+    chain: Runnable,
+    inputs: dict,
+    config: dict,
+    on_update: Callable[[str], None],
+    refresh_seconds: float = STREAM_REFRESH_SECONDS,
+) -> Tuple[str, TurnMetrics]:
+    """Stream the ``answer`` key of a retrieval chain, calling ``on_update`` with the text so far.
+
+    Updates are throttled to one per ``refresh_seconds`` so long answers do not
+    flood the browser with re-renders; the final text is always delivered.
+    """
+    started = time.perf_counter()
+    first_token = None
+    last_update = 0.0
+    chunks = 0
+    answer = ""
+    for chunk in chain.stream(inputs, config=config):
+        token = chunk.get("answer")
+        if not token:
+            continue
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now - started
+        chunks += 1
+        answer += token
+        if now - last_update >= refresh_seconds:
+            on_update(answer)
+            last_update = now
+    on_update(answer)
+    return answer, TurnMetrics(first_token, time.perf_counter() - started, streamed=True, chunks=chunks)
+
+
+def invoke_answer(chain: Runnable, inputs: dict, config: dict) -> Tuple[str, TurnMetrics]:
+    started = time.perf_counter()
+    answer = chain.invoke(inputs, config=config)["answer"]
+    elapsed = time.perf_counter() - started
+    return answer, TurnMetrics(elapsed, elapsed, streamed=False, chunks=1)
+
+
+def is_self_contained(question: str) -> bool:
+    """Cheap check for questions that can be retrieved without the chat history."""
+    text = question.strip().lower()
+    words = _WORD_PATTERN.findall(text)
+    if len(words) < 4 or text.startswith(_FOLLOW_UP_OPENINGS):
+        return False
+    return not any(word in _REFERENCE_WORDS for word in words)
+
+
+class RewriteCache:
+    """Process-wide LRU of standalone questions keyed by recent history and input."""
+
+    def __init__(self, max_entries: int = REWRITE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(history: List[BaseMessage], question: str) -> str:
+        digest = hashlib.sha256()
+        for message in history[-REWRITE_HISTORY_MESSAGES:]:
+            digest.update(f"{message.type}\x00{message.content}\x00".encode("utf-8"))
+        digest.update(question.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+rewrite_cache = RewriteCache()
+
+
+class QuestionRewriter:
+    """Turns follow-up questions into standalone ones, skipping the LLM when it can.
+
+    The raw question goes straight to retrieval when there is no history or it
+    already reads as self-contained, which is reported to callbacks as a
+    ``REWRITE_SKIPPED_EVENT``; other rewrites are served from ``rewrite_cache``
+    before falling back to the contextualize prompt.
+    """
+
+    def __init__(self, llm: BaseLanguageModel, prompt: BasePromptTemplate, cache: RewriteCache = rewrite_cache):
+        self.chain = prompt | llm | StrOutputParser()
+        self.cache = cache
+
+    def _fast_path(self, inputs: dict) -> Tuple[Optional[str], Optional[str]]:
+        history = inputs.get("chat_history") or []
+        question = inputs["input"]
+        if not history or is_self_contained(question):
+            return question, None
+        key = self.cache.key(history, question)
+        return self.cache.get(key), key
+
+    def rewrite(self, inputs: dict, config: RunnableConfig) -> str:
+        question, key = self._fast_path(inputs)
+        if key is None:
+            dispatch_custom_event(REWRITE_SKIPPED_EVENT, {}, config=config)
+        elif question is None:
+            question = self.chain.invoke({"chat_history": inputs["chat_history"], "input": inputs["input"]})
+            self.cache.put(key, question)
+        return question
+
+    async def arewrite(self, inputs: dict, config: RunnableConfig) -> str:
+        question, key = self._fast_path(inputs)
+        if key is None:
+            await adispatch_custom_event(REWRITE_SKIPPED_EVENT, {}, config=config)
+        elif question is None:
+            question = await self.chain.ainvoke({"chat_history": inputs["chat_history"], "input": inputs["input"]})
+            self.cache.put(key, question)
+        return question
+
+
+def build_history_aware_retriever(
+    llm: BaseLanguageModel, retriever: BaseRetriever, prompt: BasePromptTemplate
+) -> Runnable:
+    """Drop-in replacement for ``create_history_aware_retriever`` backed by ``QuestionRewriter``."""
+    rewriter = QuestionRewriter(llm, prompt)
+    standalone_question = RunnableLambda(rewriter.rewrite, afunc=rewriter.arewrite, name="rewrite_question")
+    return (standalone_question | retriever).with_config(run_name="chat_retriever_chain")
@@ -0,0 +1,196 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from settings import CONTEXT_TOKEN_BUDGET
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Llama3-8b-8192 shares its window between the system prompt, retrieved
+# context, chat history, the question and the answer it generates.
+MODEL_CONTEXT_TOKENS = 8192
+ANSWER_RESERVE_TOKENS = 1024
+PROMPT_OVERHEAD_TOKENS = 128
+MIN_CHUNK_TOKENS = 120
+TOKENIZER_ENCODING = "cl100k_base"
+
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset("""
+    a an and are as at be by can did do does for from has have how i in is it me my
+    of on or our that the their this to was we were what when where which who why will
+    with you your about please tell give explain
+""".split())
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count using a BPE tokenizer when tiktoken is installed, else a 4-chars-per-token estimate."""
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception:
+            # The BPE file is downloaded on first use; stay on the estimate when offline
+            tiktoken = None
+    if _encoding is None:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(count_tokens(str(message.content)) + 4 for message in messages)
+
+
+def _terms(text: str) -> set:
+    return {word for word in _WORD_PATTERN.findall(text.lower()) if word not in _STOP_WORDS}
+
+
+def remove_overlap(documents: List[Document]) -> List[Document]:
+    """Drop text already present in a higher-ranked chunk from the same page.
+
+    Neighbouring chunks share ``chunk_overlap`` characters; using each chunk's
+    ``start_index`` the shared span is cut from whichever chunk ranks lower.
+    Chunks without position metadata are kept as they are.
+    """
+    covered: Dict[Tuple, List[Tuple[int, int]]] = {}
+    result = []
+    for doc in documents:
+        start = doc.metadata.get("start_index")
+        if start is None:
+            result.append(doc)
+            continue
+        key = (doc.metadata.get("file_hash") or doc.metadata.get("source"), doc.metadata.get("page"))
+        begin, end = start, start + len(doc.page_content)
+        for other_begin, other_end in covered.get(key, []):
+            if other_begin <= begin < other_end:
+                begin = other_end
+            if other_begin < end <= other_end:
+                end = other_begin
+        if begin >= end:
+            continue
+        covered.setdefault(key, []).append((start, start + len(doc.page_content)))
+        if (begin, end) == (start, start + len(doc.page_content)):
+            result.append(doc)
+        else:
+            text = doc.page_content[begin - start:end - start].strip()
+            if text:
+                result.append(Document(page_content=text, metadata=dict(doc.metadata), id=doc.id))
+    return result
+
+
+def _best_match(parts: Sequence[str], question: str) -> int:
+    query = _terms(question)
+    return max(range(len(parts)), key=lambda i: (len(query & _terms(parts[i])), -i))
+
+
+def trim_to_words(text: str, question: str, max_tokens: int) -> str:
+    """Keep the longest run of words from the best-matching line of ``text`` that fits in ``max_tokens``.
+
+    The run starts a little before that line so it keeps some lead-in.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return ""
+    best = _best_match(lines, question)
+    words = text.split()
+    anchor = sum(len(line.split()) for line in lines[:best])
+
+    def window(size: int) -> str:
+        start = min(max(0, anchor - size // 4), len(words) - size)
+        return " ".join(words[start:start + size])
+
+    # Longest window that fits, by binary search on its word count
+    low, high = 0, len(words)
+    while low < high:
+        size = (low + high + 1) // 2
+        if count_tokens(window(size)) <= max_tokens:
+            low = size
+        else:
+            high = size - 1
+    return window(low) if low else ""
+
+
+def trim_to_sentences(text: str, question: str, max_tokens: int) -> str:
+    """Keep the sentences around the best match for ``question`` that fit in ``max_tokens``.
+
+    A best sentence too long on its own is cut to the words around its best-matching line.
+    """
+    sentences = [sentence.strip() for sentence in _SENTENCE_PATTERN.split(text) if sentence.strip()]
+    if not sentences:
+        return ""
+    best = _best_match(sentences, question)
+    costs = [count_tokens(sentence) + 1 for sentence in sentences]
+    if costs[best] > max_tokens:
+        return trim_to_words(sentences[best], question, max_tokens)
+    low, high, used = best, best, costs[best]
+    # Grow the window one sentence at a time, preferring the side closer to the match
+    while True:
+        grown = False
+        for candidate in (high + 1, low - 1):
+            if 0 <= candidate < len(sentences) and used + costs[candidate] <= max_tokens:
+                used += costs[candidate]
+                low, high = min(low, candidate), max(high, candidate)
+                grown = True
+        if not grown:
+            break
+    return " ".join(sentences[low:high + 1])
+
+
+class ContextPacker:
+    """Fits retrieved chunks into a token budget for the stuff-documents chain.
+
+    Chunks keep their retrieval order, which is their relevance rank. Overlap
+    shared with a higher-ranked chunk is removed first; a chunk that still
+    does not fit is cut down to the sentences around its best match for the
+    question, keeping at least ``MIN_CHUNK_TOKENS`` for each chunk after it.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, model_tokens: int = MODEL_CONTEXT_TOKENS):
+        self.budget = budget
+        self.model_tokens = model_tokens
+
+    def available(self, question: str, history: Optional[Sequence[BaseMessage]] = None) -> int:
+        """Context budget left once the history, question and answer are accounted for."""
+        reserved = ANSWER_RESERVE_TOKENS + PROMPT_OVERHEAD_TOKENS + count_tokens(question)
+        reserved += count_message_tokens(history or [])
+        return max(0, min(self.budget, self.model_tokens - reserved))
+
+    def pack(self, documents: List[Document], question: str, history: Optional[Sequence[BaseMessage]] = None) -> List[Document]:
+        documents = remove_overlap(documents)
+        remaining = self.available(question, history)
+        packed = []
+        for rank, doc in enumerate(documents):
+            allowance = remaining - MIN_CHUNK_TOKENS * (len(documents) - rank - 1)
+            allowance = max(allowance, min(remaining, MIN_CHUNK_TOKENS))
+            tokens = count_tokens(doc.page_content)
+            if tokens <= allowance:
+                packed.append(doc)
+                remaining -= tokens
+                continue
+            text = trim_to_sentences(doc.page_content, question, allowance)
+            if text:
+                packed.append(Document(page_content=text, metadata=dict(doc.metadata, trimmed=True), id=doc.id))
+                remaining -= count_tokens(text)
+        return packed
+
+
+def packed_retriever(retriever: Runnable, packer: ContextPacker) -> Runnable:
+    """Wrap a (history-aware) retriever so its documents are packed to the budget."""
+
+    def pack(inputs: dict, documents: List[Document]) -> List[Document]:
+        return packer.pack(documents, inputs["input"], inputs.get("chat_history"))
+
+    def retrieve(inputs: dict, config) -> List[Document]:
+        return pack(inputs, retriever.invoke(inputs, config=config))
+
+    async def aretrieve(inputs: dict, config) -> List[Document]:
+        return pack(inputs, await retriever.ainvoke(inputs, config=config))
+
+    return RunnableLambda(retrieve, afunc=aretrieve, name="packed_retriever")
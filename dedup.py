@@ -0,0 +1,203 @@
+import json
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from atomic_file import atomic_path
+from settings import SECTION_PAGES
+
+# Near-duplicate chunks (repeated boilerplate, the same appendix in several
+# files) are collapsed into one stored chunk. Chunks are compared by MinHash
+# signatures over word shingles; an LSH index over signature bands finds the
+# candidates, and a candidate counts as a duplicate when the estimated
+# Jaccard similarity reaches DEDUP_THRESHOLD. The kept chunk lists every
+# copy's file and page in a "provenance" metadata field, stored as a JSON
+# string because Chroma metadata values must be scalars. It also holds a
+# "section_<file hash>" field per file it is a copy in, so searches can be
+# restricted to files and sections with filters on a few values.
+NUM_PERM = 128
+LSH_BANDS = 16
+SHINGLE_WORDS = 5
+DEDUP_THRESHOLD = 0.85
+# Signatures of recently split chunks, so the write stage does not recompute them
+SIGNATURE_CACHE_SIZE = 4096
+
+# Multiply-shift hashing: the high 32 bits of a * x + b (mod 2**64), a odd
+_rng = np.random.default_rng(1)
+_A = _rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64)
+_SHIFT = np.uint64(32)
+_WORD = re.compile(r"\w+")
+_recent: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+def signature(text: str) -> np.ndarray:
+    """MinHash signature of ``text`` over lower-cased word shingles."""
+    words = _WORD.findall(text.lower())
+    shingles = {
+        " ".join(words[position:position + SHINGLE_WORDS])
+        for position in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(hashes, _A) + _B) >> _SHIFT).min(axis=0).astype(np.uint32)
+
+
+def signatures(chunks: Sequence[Document]) -> List[np.ndarray]:
+    """Signatures of ``chunks``, reusing those computed recently for the same chunk IDs."""
+    result = []
+    for chunk in chunks:
+        chunk_id = chunk.metadata.get("chunk_id")
+        with _recent_lock:
+            sig = _recent.get(chunk_id) if chunk_id else None
+        if sig is None:
+            sig = signature(chunk.page_content)
+            if chunk_id:
+                with _recent_lock:
+                    _recent[chunk_id] = sig
+                    while len(_recent) > SIGNATURE_CACHE_SIZE:
+                        _recent.popitem(last=False)
+        result.append(sig)
+    return result
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures, keyed by chunk ID."""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.keys: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._positions: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key: str, sig: np.ndarray) -> None:
+        if key in self._positions:
+            return
+        position = len(self.keys)
+        self.keys.append(key)
+        self._signatures.append(sig)
+        self._positions[key] = position
+        for buckets, band_key in zip(self._buckets, self._band_keys(sig)):
+            buckets.setdefault(band_key, []).append(position)
+
+    def query(self, sig: np.ndarray) -> Optional[Tuple[str, float]]:
+        """Closest indexed key with estimated similarity at or above the threshold, if any."""
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(sig)):
+            candidates.update(buckets.get(band_key, ()))
+        best = None
+        for position in candidates:
+            key = self.keys[position]
+            if key not in self._positions:
+                continue
+            similarity = float(np.mean(self._signatures[position] == sig))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def remove(self, keys: Sequence[str]) -> None:
+        """Forget ``keys``; their bucket entries are skipped until the index is saved and reloaded."""
+        for key in keys:
+            self._positions.pop(key, None)
+
+    def save(self, path: str) -> None:
+        live = list(self._positions.values())
+        ids = np.array([self.keys[position] for position in live], dtype=str)
+        matrix = np.stack([self._signatures[position] for position in live]) if live else np.zeros((0, NUM_PERM), dtype=np.uint32)
+        with atomic_path(path) as temp_path:
+            np.savez(temp_path, ids=ids, signatures=matrix)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = DEDUP_THRESHOLD) -> "LSHIndex":
+        index = cls(threshold)
+        with np.load(path) as data:
+            for key, sig in zip(data["ids"].tolist(), data["signatures"]):
+                index.add(key, sig)
+        return index
+
+
+def _entry(metadata: dict) -> dict:
+    return {"file_hash": metadata.get("file_hash"), "source": metadata.get("source"), "page": metadata.get("page")}
+
+
+def provenance(metadata: dict) -> List[dict]:
+    """Every copy a stored chunk stands for, itself included."""
+    stored = metadata.get("provenance")
+    return json.loads(stored) if stored else [_entry(metadata)]
+
+
+def section_key(file_hash: str) -> str:
+    """Metadata field holding a chunk's section within one file it is a copy in."""
+    return f"section_{file_hash}"
+
+
+def section_fields(metadata: dict) -> Dict[str, int]:
+    """``section_key`` fields for every file a chunk is a copy in, by its first copy there."""
+    fields: Dict[str, int] = {}
+    for entry in provenance(metadata):
+        if entry["file_hash"]:
+            fields.setdefault(section_key(entry["file_hash"]), int(entry.get("page") or 0) // SECTION_PAGES)
+    return fields
+
+
+def merge_provenance(metadata: dict, entries: Sequence[dict]) -> None:
+    """Add ``entries`` to a chunk's provenance in place, skipping copies it already lists."""
+    merged = provenance(metadata)
+    for entry in entries:
+        if entry not in merged:
+            merged.append(entry)
+    metadata["provenance"] = json.dumps(merged)
+    metadata.update(section_fields(metadata))
+
+
+def drop_provenance(metadata: dict, file_hash: str) -> dict:
+    """Metadata update removing ``file_hash``'s copies from a chunk's provenance.
+
+    If the chunk was stored for that file, a remaining copy becomes its
+    source. The file's section field is None, which Chroma treats as a
+    deletion, and so is ``provenance`` once a single copy is left.
+    """
+    remaining = [entry for entry in provenance(metadata) if entry["file_hash"] != file_hash]
+    updated = dict(metadata)
+    if remaining and updated.get("file_hash") == file_hash:
+        updated.update(remaining[0])
+    updated["provenance"] = json.dumps(remaining) if len(remaining) > 1 else None
+    updated[section_key(file_hash)] = None
+    return updated
+
+
+def collapse_duplicates(chunks: Sequence[Document], threshold: float = DEDUP_THRESHOLD) -> Tuple[List[Document], List[np.ndarray]]:
+    """Drop near-duplicates within ``chunks``, recording them on the chunk kept.
+
+    Returns the kept chunks and their signatures, in order.
+    """
+    index = LSHIndex(threshold)
+    kept: Dict[str, Document] = {}
+    kept_signatures: List[np.ndarray] = []
+    for chunk, sig in zip(chunks, signatures(chunks)):
+        match = index.query(sig)
+        if match is not None:
+            merge_provenance(kept[match[0]].metadata, provenance(chunk.metadata))
+            continue
+        chunk_id = chunk.metadata["chunk_id"]
+        index.add(chunk_id, sig)
+        kept[chunk_id] = chunk
+        kept_signatures.append(sig)
+    return list(kept.values()), kept_signatures
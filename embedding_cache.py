@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+CACHE_DIRECTORY = "./embedding_cache"
+
+# Adaptive batching: a batch may use MEMORY_FRACTION of the available memory,
+# assuming roughly BYTES_PER_TOKEN of activations per token of the longest text.
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 256
+MEMORY_FRACTION = 0.25
+BYTES_PER_TOKEN = 24 * 1024
+CHARS_PER_TOKEN = 4
+MAX_SEQUENCE_TOKENS = 512
+# Recent query vectors kept in memory, so a turn's retrieval and answer
+# cache lookup embed the question once
+QUERY_CACHE_SIZE = 256
+
+
+class VectorCache:
+    """Persistent content-hash to float32 vector cache for one embedding model.
+
+    Vectors are appended to a flat ``vectors.f32`` file and read back through
+    a read-only memory map, so opening the cache costs only reading the key
+    list. ``keys.txt`` holds one hash per row, written after the vectors so an
+    interrupted append never exposes a partial row. Rows appended later, by
+    this or another process, are picked up from the end of ``keys.txt``.
+    """
+
+    def __init__(self, model_name: str, directory: str = CACHE_DIRECTORY):
+        self.model_name = model_name
+        self.path = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._keys_path = os.path.join(self.path, "keys.txt")
+        self._meta_path = os.path.join(self.path, "meta.json")
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._row_count = 0
+        self._keys_size = 0
+        self._matrix: Optional[np.memmap] = None
+        self.dimension: Optional[int] = None
+        self._read_meta()
+
+    def _read_meta(self) -> None:
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                self.dimension = json.load(f)["dimension"]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _extend(self, keys: List[str], keys_size: int) -> None:
+        for key in keys:
+            self._rows[key] = self._row_count
+            self._row_count += 1
+        self._keys_size = keys_size
+        if self._row_count:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._row_count, self.dimension))
+
+    def _refresh(self) -> None:
+        # Other processes may have appended since we last looked
+        try:
+            keys_size = os.path.getsize(self._keys_path)
+        except OSError:
+            return
+        if keys_size == self._keys_size:
+            return
+        if not self.dimension:
+            # Another process created the cache after we opened it
+            self._read_meta()
+            if not self.dimension:
+                return
+        if keys_size < self._keys_size:
+            # The cache was cleared underneath us
+            self._rows, self._row_count, self._keys_size, self._matrix = {}, 0, 0, None
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_size)
+            tail = f.read(keys_size - self._keys_size)
+        # Stop at the last complete line; a concurrent append may be half written
+        complete = tail.rfind(b"\n") + 1
+        if complete:
+            self._extend(tail[:complete].decode("ascii").split(), self._keys_size + complete)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        with self._lock:
+            self._refresh()
+            found = {}
+            for key in keys:
+                row = self._rows.get(key)
+                if row is not None:
+                    found[key] = self._matrix[row].tolist()
+            return found
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]) -> None:
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            if self.dimension is None:
+                self.dimension = int(matrix.shape[1])
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model_name": self.model_name, "dimension": self.dimension}, f)
+            self._refresh()
+            new = [index for index, key in enumerate(keys) if key not in self._rows]
+            if not new:
+                return
+            with open(self._vectors_path, "ab") as f:
+                # Drop vectors left by an append interrupted before its keys were written
+                f.truncate(self._row_count * 4 * self.dimension)
+                f.write(matrix[new].tobytes())
+            lines = "".join(f"{keys[index]}\n" for index in new)
+            with open(self._keys_path, "a", encoding="ascii") as f:
+                f.write(lines)
+            self._extend([keys[index] for index in new], self._keys_size + len(lines))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+
+def available_memory() -> Optional[int]:
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def adaptive_batch_size(longest_text: int, memory: Optional[int] = None) -> int:
+    """Largest batch whose activations for ``longest_text`` characters fit the memory budget."""
+    memory = available_memory() if memory is None else memory
+    if memory is None:
+        return 32
+    tokens = min(longest_text // CHARS_PER_TOKEN + 2, MAX_SEQUENCE_TOKENS)
+    size = int(memory * MEMORY_FRACTION) // (tokens * BYTES_PER_TOKEN)
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, size))
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings wrapper that never encodes the same text twice.
+
+    Texts are looked up in the persistent ``VectorCache`` first; the rest are
+    deduplicated, sorted by length so each batch pads to similar lengths, and
+    encoded in batches sized from the memory currently available. The
+    latest ``query_cache_size`` query vectors are kept in memory.
+    """
+
+    def __init__(self, base: Embeddings, cache: VectorCache, query_cache_size: int = QUERY_CACHE_SIZE):
+        self.base = base
+        self.cache = cache
+        self.query_cache_size = query_cache_size
+        self.encoded = 0
+        self.reused = 0
+        self.queries_reused = 0
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self.reused += len(texts) - len(missing)
+
+        pending = sorted(missing.items(), key=lambda item: len(item[1]), reverse=True)
+        while pending:
+            size = adaptive_batch_size(len(pending[0][1]))
+            batch, pending = pending[:size], pending[size:]
+            batch_keys = [key for key, _ in batch]
+            batch_vectors = self.base.embed_documents([text for _, text in batch])
+            self.cache.put_many(batch_keys, batch_vectors)
+            vectors.update(zip(batch_keys, batch_vectors))
+            self.encoded += len(batch)
+        return [list(vectors[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.queries_reused += 1
+                return list(vector)
+        vector = self.base.embed_query(text)
+        with self._queries_lock:
+            self._queries[text] = list(vector)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
@@ -0,0 +1,273 @@
+"""Headless question answering over a document set with the Document Chat pipeline.
+
+``build_rag_chain`` assembles the same retrieval chain the chat tab uses;
+``run_batch`` answers many independent questions against it concurrently,
+capped by a semaphore and paced by a token-bucket rate limiter so Groq's
+request limits are respected. The CLI indexes the given PDFs and streams one
+JSON line per question as answers finish, in completion order.
+
+    python engine.py --pdf report.pdf --questions questions.txt --output answers.jsonl
+    python engine.py --pdf report.pdf --questions questions.jsonl --stub-llm --fake-embeddings
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from langchain.chains import create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable
+from langchain_core.vectorstores import VectorStore
+
+from answer_cache import cached_answer_chain
+from chat import build_history_aware_retriever, build_prompts
+from context import CONTEXT_TOKEN_BUDGET, ContextPacker, packed_retriever
+from dedup import provenance
+from faiss_index import get_retriever
+from hierarchy import get_retriever as get_hierarchical_retriever
+from index_manager import IndexManager
+from ingestion import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    EMBEDDING_MODEL,
+    MAX_WORKERS,
+    content_hash,
+    ingest_files,
+    stream_file,
+)
+from settings import BACKENDS, DEFAULT_BACKEND, HIERARCHY_DOCUMENTS, HIERARCHY_SECTIONS, RETRIEVAL_K
+from tracing import TurnTracer
+from vector_store import collection_name
+
+BATCH_CONCURRENCY = 8
+# Groq's free tier allows 30 requests a minute for Llama3-8b-8192
+REQUESTS_PER_SECOND = 0.5
+REQUEST_BURST = 5
+
+
+def build_rag_chain(
+    llm: BaseLanguageModel,
+    vectorstore: VectorStore,
+    embeddings: Embeddings,
+    document_set: str,
+    k: int = RETRIEVAL_K,
+    context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+    answer_cache_threshold: Optional[float] = None,
+    retriever: Optional[BaseRetriever] = None,
+) -> Runnable:
+    """Retrieval chain taking ``{"input", "chat_history"}`` and returning ``context`` and ``answer``.
+
+    Searches ``vectorstore`` directly unless another ``retriever`` over the
+    same chunks is given, such as a FAISS backend.
+    """
+    contextualize_prompt, qa_prompt = build_prompts()
+    if retriever is None:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+    history_aware_retriever = build_history_aware_retriever(llm, retriever, contextualize_prompt)
+    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+    return create_retrieval_chain(
+        packed_retriever(history_aware_retriever, ContextPacker(context_token_budget)),
+        cached_answer_chain(question_answer_chain, embeddings, document_set, answer_cache_threshold)
+    )
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens a second, holding at most ``capacity``."""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, capacity: int = REQUEST_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Holding the lock while sleeping keeps waiters in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _sources(documents) -> List[dict]:
+    sources = []
+    for doc in documents:
+        source = {"source": doc.metadata.get("source"), "page": doc.metadata.get("page"), "chunk_id": doc.metadata.get("chunk_id")}
+        # Chunks that stand for near-duplicates elsewhere list every copy
+        if doc.metadata.get("provenance"):
+            source["copies"] = provenance(doc.metadata)
+        sources.append(source)
+    return sources
+
+
+async def run_batch(
+    chain: Runnable,
+    questions: Iterable[Tuple[str, str]],
+    concurrency: int = BATCH_CONCURRENCY,
+    limiter: Optional[TokenBucket] = None,
+) -> AsyncIterator[dict]:
+    """Answer ``(id, question)`` pairs concurrently, yielding each result as it finishes.
+
+    Questions are independent: each runs with an empty chat history. A
+    failed question yields a result with ``error`` set instead of stopping
+    the batch.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(question_id: str, question: str) -> dict:
+        async with semaphore:
+            if limiter is not None:
+                await limiter.acquire()
+            started = time.perf_counter()
+            tracer = TurnTracer()
+            result = {"id": question_id, "question": question, "trace_id": tracer.trace.trace_id}
+            try:
+                output = await chain.ainvoke({"input": question, "chat_history": []}, {"callbacks": [tracer]})
+                result.update(answer=output["answer"], sources=_sources(output["context"]), error=None)
+            except Exception as e:
+                result.update(answer=None, sources=[], error=f"{type(e).__name__}: {e}")
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            return result
+
+    tasks = [asyncio.ensure_future(answer(question_id, question)) for question_id, question in questions]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def read_questions(path: str) -> List[Tuple[str, str]]:
+    """Questions from a ``.jsonl`` file of ``{"id", "question"}`` objects or a text file, one per line."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                questions.append((str(record.get("id", number)), record["question"]))
+            else:
+                questions.append((str(number), line))
+    return questions
+
+
+def load_llm(args) -> BaseLanguageModel:
+    if args.stub_llm:
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        return FakeListChatModel(responses=["This is a stub answer from the batch engine."])
+    from resources import get_llm
+    api_key = args.api_key or os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise SystemExit("A Groq API key is required: pass --api-key or set GROQ_API_KEY (or use --stub-llm).")
+    return get_llm(api_key)
+
+
+def load_embeddings(fake: bool) -> Embeddings:
+    if fake:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=384)
+    from resources import get_embeddings
+    return get_embeddings(EMBEDDING_MODEL)
+
+
+def build_index(paths: List[str], embeddings: Embeddings, args):
+    """Index the PDFs in a collection named after their content, reused by later runs."""
+    model_name = "fake" if args.fake_embeddings else EMBEDDING_MODEL
+    uploads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            uploads.append((os.path.basename(path), f.read()))
+    index = IndexManager(
+        collection_name([content_hash(data) for _, data in uploads], CHUNK_SIZE, CHUNK_OVERLAP, model_name),
+        embeddings
+    )
+    _, errors = index.sync(
+        uploads,
+        lambda files: ingest_files(files, embeddings, model_name=model_name, max_workers=args.workers),
+        lambda name, data: stream_file(name, data, embeddings, max_workers=args.workers)
+    )
+    for name, e in errors:
+        print(f"Error processing file {name}: {e}", file=sys.stderr)
+    if not index.files:
+        raise SystemExit("No valid documents could be processed.")
+    return index
+
+
+async def _run(args) -> int:
+    embeddings = load_embeddings(args.fake_embeddings)
+    index = build_index(args.pdf, embeddings, args)
+    if args.hierarchical:
+        retriever, summaries = get_hierarchical_retriever(
+            index.vectorstore, embeddings, index.name, index.files,
+            documents=args.coarse_documents, sections=args.coarse_sections, k=args.k
+        )
+        report = None
+        print(f"hierarchical: {summaries.documents} documents, {summaries.section_count} sections", file=sys.stderr)
+    else:
+        retriever, report = get_retriever(
+            index.vectorstore, embeddings, index.name, args.backend, index.document_set, k=args.k
+        )
+    if report:
+        print(f"{args.backend}: recall@{report['k']} {report['recall_at_k']}, {report['index_bytes']} bytes", file=sys.stderr)
+    chain = build_rag_chain(
+        load_llm(args), index.vectorstore, embeddings, index.document_set,
+        k=args.k, context_token_budget=args.context_token_budget, retriever=retriever
+    )
+    questions = read_questions(args.questions)
+    limiter = TokenBucket(args.rate, args.burst) if args.rate > 0 else None
+
+    done = failed = 0
+    started = time.perf_counter()
+    output = open(args.output, "w", encoding="utf-8") if args.output != "-" else sys.stdout
+    try:
+        async for result in run_batch(chain, questions, args.concurrency, limiter):
+            done += 1
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            failed += result["error"] is not None
+            print(f"[{done}/{len(questions)}] {result['id']} {result['seconds']:.2f}s", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Answered {len(questions) - failed}/{len(questions)} questions in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", nargs="+", required=True, help="PDF files forming the document set")
+    parser.add_argument("--questions", required=True, help="text file with one question per line, or .jsonl with id/question")
+    parser.add_argument("--output", default="-", help="JSONL file for the answers (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="questions in flight at once")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="questions started per second; 0 disables")
+    parser.add_argument("--burst", type=int, default=REQUEST_BURST, help="questions that may start back to back")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="vector search backend")
+    parser.add_argument("--k", type=int, default=RETRIEVAL_K, help="chunks retrieved per question")
+    parser.add_argument("--hierarchical", action="store_true", help="search the best documents and sections first (ignores --backend)")
+    parser.add_argument("--coarse-documents", type=int, default=HIERARCHY_DOCUMENTS, help="documents kept by the first hierarchical stage")
+    parser.add_argument("--coarse-sections", type=int, default=HIERARCHY_SECTIONS, help="sections kept within those documents")
+    parser.add_argument("--context-token-budget", type=int, default=CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="PDF extraction processes")
+    parser.add_argument("--api-key", help="Groq API key (default: GROQ_API_KEY)")
+    parser.add_argument("--stub-llm", action="store_true", help="answer with a local stub model instead of Groq")
+    parser.add_argument("--fake-embeddings", action="store_true", help="use deterministic fake vectors")
+    args = parser.parse_args(argv)
+    return asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
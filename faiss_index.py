@@ -0,0 +1,407 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from atomic_file import atomic_path, write_json
+from settings import available_backends
+from vector_store import PERSIST_DIRECTORY
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Chroma stays the store of record; FAISS backends (listed in settings) are
+# derived indexes built from a collection's stored vectors, written next to it
+# and memory-mapped on load. Documents are always read back from Chroma by
+# chunk ID. Recall is measured against an exact scan with queries that are
+# stored vectors plus noise of norm RECALL_QUERY_NOISE, so they are not
+# indexed points themselves.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# IVF searches start at 1/16 of the lists and probe twice as many until
+# recall reaches IVF_TARGET_RECALL or stops improving; the result is reported.
+IVF_MIN_NPROBE = 8
+IVF_TARGET_RECALL = 0.95
+PQ_SUBQUANTIZERS = 48
+# Product quantization caps recall whatever the probes, so IVF-PQ searches
+# fetch this many candidates per result and re-rank them by their stored vectors
+PQ_RERANK = 4
+TRAIN_SAMPLE = 50000
+# Quantizers train about 39 points per centroid; 8-bit PQ codebooks have 256.
+# Smaller collections get an exact Flat index instead of a degenerate IVF one.
+MIN_QUANTIZED_VECTORS = 39 * 256
+READ_BATCH = 5000
+RECALL_QUERIES = 100
+RECALL_QUERY_NOISE = 0.75
+RECALL_K = 10
+
+_loaded: Dict[str, Tuple[float, "faiss.Index", np.ndarray]] = {}
+_loaded_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def index_paths(name: str, backend: str, persist_directory: str = PERSIST_DIRECTORY) -> Tuple[str, str, str]:
+    """Index, chunk-ID and report files of one derived index."""
+    base = os.path.join(persist_directory, f"{name}.{backend}")
+    return f"{base}.faiss", f"{base}.ids.npy", f"{base}.json"
+
+
+def read_report(name: str, backend: str, persist_directory: str = PERSIST_DIRECTORY) -> Optional[dict]:
+    try:
+        with open(index_paths(name, backend, persist_directory)[2], encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _iter_vectors(vectorstore: Chroma, batch_size: int = READ_BATCH, normalise: bool = True) -> Iterator[Tuple[List[str], np.ndarray]]:
+    offset = 0
+    while True:
+        page = vectorstore.get(include=["embeddings"], limit=batch_size, offset=offset)
+        if not page["ids"]:
+            return
+        vectors = np.ascontiguousarray(page["embeddings"], dtype=np.float32)
+        if normalise:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        yield page["ids"], vectors
+        offset += len(page["ids"])
+
+
+def default_nprobe(nlist: int) -> int:
+    return min(nlist, max(IVF_MIN_NPROBE, nlist // 16))
+
+
+def _recall_queries(sample: np.ndarray, normalise: bool = True) -> np.ndarray:
+    """Stored vectors moved by noise of norm about RECALL_QUERY_NOISE times their own."""
+    rng = np.random.default_rng(0)
+    picked = sample[rng.choice(len(sample), size=min(RECALL_QUERIES, len(sample)), replace=False)]
+    scale = np.linalg.norm(picked, axis=1, keepdims=True) * RECALL_QUERY_NOISE / math.sqrt(picked.shape[1])
+    queries = (picked + rng.standard_normal(picked.shape).astype(np.float32) * scale).astype(np.float32)
+    if normalise:
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return queries
+
+
+def _factory_string(backend: str, dim: int, count: int) -> str:
+    if backend == "faiss-flat" or (backend in ("faiss-ivfpq", "faiss-ivfsq8") and count < MIN_QUANTIZED_VECTORS):
+        return "Flat"
+    if backend == "faiss-hnsw":
+        return f"HNSW{HNSW_M}"
+    # Roughly 4 * sqrt(n) lists, with enough training points per list
+    nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+    if backend == "faiss-ivfsq8":
+        return f"IVF{nlist},SQ8"
+    subquantizers = max(m for m in range(1, PQ_SUBQUANTIZERS + 1) if dim % m == 0)
+    # PQ codebooks likewise need about 39 training points per centroid
+    bits = max(1, min(8, int(math.log2(max(count // 39, 2)))))
+    return f"IVF{nlist},PQ{subquantizers}x{bits}"
+
+
+def _exact_neighbours(vectorstore: Chroma, queries: np.ndarray, k: int, space: str = "cosine") -> List[List[str]]:
+    """Exact top-``k`` chunk IDs per query under ``space`` (cosine, ip or l2), streamed so the full matrix is never held."""
+    best: List[List[Tuple[float, str]]] = [[] for _ in range(len(queries))]
+    for ids, vectors in _iter_vectors(vectorstore, normalise=space == "cosine"):
+        scores = queries @ vectors.T
+        if space == "l2":
+            # Ranks like -|q - x|^2; |q|^2 is the same for every candidate
+            scores = 2 * scores - np.sum(vectors * vectors, axis=1)
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        for row, heap in enumerate(best):
+            for column in top[row]:
+                item = (float(scores[row, column]), ids[column])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                else:
+                    heapq.heappushpop(heap, item)
+    return [[chunk_id for _, chunk_id in sorted(heap, reverse=True)] for heap in best]
+
+
+def _rerank(query: np.ndarray, chunk_ids: List[str], embeddings, k: int) -> List[str]:
+    """The ``k`` of ``chunk_ids`` closest to a normalised ``query`` by their stored ``embeddings``."""
+    if not chunk_ids:
+        return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+    return [chunk_ids[position] for position in np.argsort(-scores)[:k]]
+
+
+def _measure(search, queries: np.ndarray, truth: List[List[str]], k: int) -> Tuple[float, float]:
+    """Recall@k against ``truth`` and median milliseconds per query of ``search(query, k)``."""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        query_started = time.perf_counter()
+        found = search(query, k)
+        latencies.append((time.perf_counter() - query_started) * 1000)
+        hits += len(set(found) & set(expected))
+    return hits / (len(truth) * k), float(np.median(latencies))
+
+
+def build_index(
+    vectorstore: Chroma,
+    name: str,
+    backend: str,
+    document_set: str,
+    persist_directory: str = PERSIST_DIRECTORY,
+    k: int = RECALL_K,
+) -> dict:
+    """Build a derived FAISS index for a collection and report its cost and quality.
+
+    The report records build time, index size on disk, recall@k against an
+    exact scan, and median single-query latency. IVF indexes also record
+    the ``nprobe`` chosen for them. When an IVF backend falls back to Flat,
+    ``fallback`` says why.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss-cpu is not installed")
+    started = time.perf_counter()
+    count = vectorstore._collection.count()
+    if not count:
+        raise ValueError(f"Collection {name} is empty")
+
+    # IVF quantizers are trained on the first TRAIN_SAMPLE vectors
+    batches = []
+    for _, vectors in _iter_vectors(vectorstore):
+        batches.append(vectors)
+        if sum(len(batch) for batch in batches) >= TRAIN_SAMPLE:
+            break
+    sample = np.concatenate(batches)
+    dimensions = int(sample.shape[1])
+    factory = _factory_string(backend, dimensions, count)
+    index = faiss.index_factory(dimensions, factory, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(sample)
+    if backend == "faiss-hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+
+    all_ids: List[str] = []
+    for ids, vectors in _iter_vectors(vectorstore):
+        index.add(vectors)
+        all_ids.extend(ids)
+    build_seconds = time.perf_counter() - started
+
+    index_path, ids_path, report_path = index_paths(name, backend, persist_directory)
+    with atomic_path(index_path) as temp_index, atomic_path(ids_path) as temp_ids:
+        faiss.write_index(index, temp_index)
+        np.save(temp_ids, np.array(all_ids, dtype=f"S{max(len(chunk_id) for chunk_id in all_ids)}"))
+
+    # Quality and latency are measured on the memory-mapped copy that serves queries
+    index, chunk_ids = load_index(name, backend, persist_directory, {"factory": factory})
+    queries = _recall_queries(sample)
+    k = min(k, count)
+    truth = _exact_neighbours(vectorstore, queries, k)
+
+    rerank = PQ_RERANK if ",PQ" in factory else 1
+
+    def search(query: np.ndarray, k: int) -> List[str]:
+        _, positions = index.search(query.reshape(1, -1), k * rerank)
+        found = [chunk_ids[position].decode("utf-8") for position in positions[0] if position >= 0]
+        if rerank == 1:
+            return found
+        stored = vectorstore.get(ids=found, include=["embeddings"])
+        return _rerank(query, stored["ids"], stored["embeddings"], k)
+
+    recall, latency = _measure(search, queries, truth, k)
+    nprobe = None
+    if factory.startswith("IVF"):
+        ivf = faiss.extract_index_ivf(index)
+        nprobe = ivf.nprobe
+        while recall < IVF_TARGET_RECALL and nprobe < ivf.nlist:
+            ivf.nprobe = min(ivf.nlist, nprobe * 2)
+            more_recall, more_latency = _measure(search, queries, truth, k)
+            if more_recall - recall < 0.01:
+                ivf.nprobe = nprobe
+                break
+            nprobe, recall, latency = ivf.nprobe, more_recall, more_latency
+
+    report = {
+        "backend": backend,
+        "document_set": document_set,
+        "vectors": count,
+        "dimensions": dimensions,
+        "factory": factory,
+        "build_seconds": round(build_seconds, 3),
+        "index_bytes": os.path.getsize(index_path),
+        "raw_vector_bytes": count * dimensions * 4,
+        "k": k,
+        "recall_at_k": round(recall, 4),
+        "search_ms_p50": round(latency, 3),
+        "built": time.time(),
+    }
+    if nprobe is not None:
+        report["nprobe"] = nprobe
+    if rerank > 1:
+        report["rerank"] = rerank
+    if factory == "Flat" and backend != "faiss-flat":
+        report["fallback"] = f"{count} vectors is below the {MIN_QUANTIZED_VECTORS} needed to train {backend}; using exact search"
+    write_json(report_path, report)
+    return report
+
+
+def chroma_report(
+    vectorstore: Chroma,
+    name: str,
+    document_set: str,
+    persist_directory: str = PERSIST_DIRECTORY,
+    k: int = RECALL_K,
+) -> dict:
+    """Report on Chroma's own HNSW index in the same shape as ``build_index``.
+
+    Chroma builds its index as chunks are inserted, so ``build_seconds`` is
+    None, and ``index_bytes`` estimates the HNSW graph held in memory from
+    the collection's configuration. Recall is measured in Chroma's distance.
+    """
+    count = vectorstore._collection.count()
+    if not count:
+        raise ValueError(f"Collection {name} is empty")
+    hnsw = (getattr(vectorstore._collection, "configuration_json", None) or {}).get("hnsw") or {}
+    space = hnsw.get("space") or (vectorstore._collection.metadata or {}).get("hnsw:space", "l2")
+    neighbours = hnsw.get("max_neighbors", 16)
+
+    sample = next(_iter_vectors(vectorstore, normalise=False))[1]
+    dimensions = int(sample.shape[1])
+    queries = _recall_queries(sample, normalise=space == "cosine")
+    k = min(k, count)
+    truth = _exact_neighbours(vectorstore, queries, k, space)
+
+    def search(query: np.ndarray, k: int) -> List[str]:
+        return vectorstore._collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+
+    recall, latency = _measure(search, queries, truth, k)
+    report = {
+        "backend": "chroma",
+        "document_set": document_set,
+        "vectors": count,
+        "dimensions": dimensions,
+        "factory": f"HNSW{neighbours}, {space}",
+        "build_seconds": None,
+        # Vectors, the bottom layer's links and a label per element
+        "index_bytes": count * (dimensions * 4 + 2 * neighbours * 4 + 12),
+        "raw_vector_bytes": count * dimensions * 4,
+        "k": k,
+        "recall_at_k": round(recall, 4),
+        "search_ms_p50": round(latency, 3),
+        "built": time.time(),
+    }
+    write_json(index_paths(name, "chroma", persist_directory)[2], report)
+    return report
+
+
+def current_report(name: str, backend: str, document_set: str, persist_directory: str = PERSIST_DIRECTORY) -> Optional[dict]:
+    """The backend's report if it was made for ``document_set``, else None."""
+    report = read_report(name, backend, persist_directory)
+    if report is None or report.get("document_set") != document_set:
+        return None
+    if backend != "chroma" and not os.path.exists(index_paths(name, backend, persist_directory)[0]):
+        return None
+    return report
+
+
+def ensure_index(
+    vectorstore: Chroma, name: str, backend: str, document_set: str, persist_directory: str = PERSIST_DIRECTORY
+) -> dict:
+    """Build the backend's index for ``document_set``, or measure Chroma's, unless that is already done."""
+    with _build_lock:
+        report = current_report(name, backend, document_set, persist_directory)
+        if report is None:
+            if backend == "chroma":
+                report = chroma_report(vectorstore, name, document_set, persist_directory)
+            else:
+                report = build_index(vectorstore, name, backend, document_set, persist_directory)
+    return report
+
+
+def load_index(
+    name: str, backend: str, persist_directory: str = PERSIST_DIRECTORY, report: Optional[dict] = None
+) -> Tuple["faiss.Index", np.ndarray]:
+    """Memory-map a derived index and its chunk IDs, reusing the mapping until the file changes.
+
+    ``report`` describes the index; by default the one written with it is read.
+    """
+    index_path, ids_path, _ = index_paths(name, backend, persist_directory)
+    modified = os.path.getmtime(index_path)
+    with _loaded_lock:
+        cached = _loaded.get(index_path)
+        if cached is None or cached[0] != modified:
+            if report is None:
+                report = read_report(name, backend, persist_directory) or {}
+            ivf = report.get("factory", "").startswith("IVF")
+            # IVF inverted lists and flat code arrays are mapped by different flags
+            flag = faiss.IO_FLAG_MMAP if ivf else getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            index = faiss.read_index(index_path, flag)
+            if backend == "faiss-hnsw":
+                faiss.downcast_index(index).hnsw.efSearch = HNSW_EF_SEARCH
+            elif ivf:
+                lists = faiss.extract_index_ivf(index)
+                lists.nprobe = report.get("nprobe") or default_nprobe(lists.nlist)
+            cached = _loaded[index_path] = (modified, index, np.load(ids_path, mmap_mode="r"))
+        return cached[1], cached[2]
+
+
+class FaissRetriever(BaseRetriever):
+    """Retriever searching a derived FAISS index and reading documents from Chroma."""
+
+    vectorstore: Chroma
+    embeddings: Embeddings
+    index: object
+    chunk_ids: object
+    k: int = 3
+    rerank: int = 1
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        _, positions = self.index.search(vector, self.k * self.rerank)
+        ranked = [self.chunk_ids[position].decode("utf-8") for position in positions[0] if position >= 0]
+        if not ranked:
+            return []
+        include = ["documents", "metadatas"] + (["embeddings"] if self.rerank > 1 else [])
+        stored = self.vectorstore.get(ids=ranked, include=include)
+        if self.rerank > 1:
+            ranked = _rerank(vector[0], stored["ids"], stored["embeddings"], self.k)
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+            for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        }
+        return [by_id[chunk_id] for chunk_id in ranked if chunk_id in by_id]
+
+
+def get_retriever(
+    vectorstore: Chroma,
+    embeddings: Embeddings,
+    name: str,
+    backend: str,
+    document_set: str,
+    k: int = 3,
+    persist_directory: str = PERSIST_DIRECTORY,
+) -> Tuple[BaseRetriever, Optional[dict]]:
+    """Retriever for the chosen backend plus its build report.
+
+    FAISS indexes are rebuilt, in the calling thread, when the collection's
+    document set has changed since they were built; callers that cannot
+    wait run ``ensure_index`` in the background first.
+    """
+    if backend == "chroma" or backend not in available_backends():
+        return vectorstore.as_retriever(search_kwargs={"k": k}), None
+    report = ensure_index(vectorstore, name, backend, document_set, persist_directory)
+    index, chunk_ids = load_index(name, backend, persist_directory)
+    retriever = FaissRetriever(
+        vectorstore=vectorstore, embeddings=embeddings, index=index, chunk_ids=chunk_ids, k=k, rerank=report.get("rerank", 1)
+    )
+    return retriever, report
@@ -0,0 +1,280 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from atomic_file import atomic_path
+from dedup import provenance, section_key
+from settings import HIERARCHY_DOCUMENTS, HIERARCHY_SECTIONS, SECTION_PAGES
+from vector_store import PERSIST_DIRECTORY
+
+# Two-stage retrieval: a query first picks the closest documents and, within
+# them, the closest sections by their summary vectors, then searches only the
+# chunks of those sections. A summary vector is the normalised mean of its
+# chunks' vectors; a section is a run of SECTION_PAGES pages. A file's chunks
+# are the ones its manifest entry references, which after deduplication may
+# be stored for another file. Each chunk records its section in every file it
+# belongs to (dedup.section_key), so both stages filter on a few values per
+# file rather than on chunk IDs. Summaries are kept in
+# "<collection>.summaries.npz" next to the collection.
+READ_BATCH = 5000
+DOCUMENT_LEVEL = -1
+# Bumped when the summaries file or the chunk fields it relies on change
+SUMMARY_FORMAT = 2
+
+_loaded: Dict[str, Tuple[float, "SummaryIndex"]] = {}
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def summary_path(name: str, persist_directory: str = PERSIST_DIRECTORY) -> str:
+    return os.path.join(persist_directory, f"{name}.summaries.npz")
+
+
+def section_of(page: int) -> int:
+    return page // SECTION_PAGES
+
+
+def _any_of(clauses: List[dict]) -> dict:
+    # Chroma rejects an "$or" with a single clause
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def section_filter(selected: Iterable[Tuple[str, int]]) -> Optional[dict]:
+    """Chroma ``where`` clause restricting a search to the given ``(file_hash, section)`` pairs, or None if there are none."""
+    by_file: Dict[str, List[int]] = {}
+    for file_hash, section in selected:
+        by_file.setdefault(file_hash, []).append(int(section))
+    if not by_file:
+        return None
+    return _any_of([{section_key(file_hash): {"$in": sections}} for file_hash, sections in by_file.items()])
+
+
+def document_filter(file_hashes: Optional[Iterable[str]]) -> Optional[dict]:
+    """Chroma ``where`` clause restricting a search to the chunks of the given files, or None for all."""
+    file_hashes = list(dict.fromkeys(file_hashes or []))
+    if not file_hashes:
+        return None
+    return _any_of([{section_key(file_hash): {"$gte": 0}} for file_hash in file_hashes])
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _page_in(metadata: dict, file_hash: str) -> int:
+    """Page of a chunk within ``file_hash``, which may be one of its other copies."""
+    for entry in provenance(metadata):
+        if entry["file_hash"] == file_hash and entry.get("page") is not None:
+            return int(entry["page"])
+    return int(metadata.get("page", 0))
+
+
+class SummaryIndex:
+    """Document- and section-level summary vectors of one collection.
+
+    Rows with ``sections == DOCUMENT_LEVEL`` summarise a whole file; the
+    others summarise one section of it.
+    """
+
+    def __init__(self, file_hashes: np.ndarray, sections: np.ndarray, vectors: np.ndarray, counts: np.ndarray):
+        self.file_hashes = file_hashes
+        self.sections = sections
+        self.vectors = vectors
+        self.counts = counts
+
+    @classmethod
+    def empty(cls) -> "SummaryIndex":
+        return cls(np.array([], dtype="U64"), np.array([], dtype=np.int32), np.zeros((0, 0), dtype=np.float32), np.array([], dtype=np.int32))
+
+    @classmethod
+    def load(cls, path: str) -> "SummaryIndex":
+        with np.load(path) as data:
+            if "format" not in data or int(data["format"]) != SUMMARY_FORMAT:
+                raise ValueError(f"{path} was written in an older format")
+            return cls(data["file_hashes"], data["sections"], data["vectors"], data["counts"])
+
+    def save(self, path: str) -> None:
+        with atomic_path(path) as temp_path:
+            np.savez(temp_path, format=np.int32(SUMMARY_FORMAT), **vars(self))
+
+    @property
+    def documents(self) -> int:
+        return int(np.count_nonzero(self.sections == DOCUMENT_LEVEL))
+
+    @property
+    def section_count(self) -> int:
+        return int(np.count_nonzero(self.sections != DOCUMENT_LEVEL))
+
+    def select(
+        self,
+        query: np.ndarray,
+        documents: int = HIERARCHY_DOCUMENTS,
+        sections: int = HIERARCHY_SECTIONS,
+        file_hashes: Optional[Iterable[str]] = None,
+    ) -> List[Tuple[str, int]]:
+        """``(file_hash, section)`` pairs of the closest sections within the closest documents."""
+        if not len(self.sections):
+            return []
+        allowed = np.ones(len(self.sections), dtype=bool)
+        if file_hashes:
+            allowed = np.isin(self.file_hashes, list(file_hashes))
+        scores = self.vectors @ query
+
+        document_rows = np.flatnonzero(allowed & (self.sections == DOCUMENT_LEVEL))
+        best_documents = document_rows[np.argsort(-scores[document_rows])[:documents]]
+        section_rows = np.flatnonzero(
+            allowed & (self.sections != DOCUMENT_LEVEL) & np.isin(self.file_hashes, self.file_hashes[best_documents])
+        )
+        best_sections = section_rows[np.argsort(-scores[section_rows])[:sections]]
+        return [(str(self.file_hashes[row]), int(self.sections[row])) for row in best_sections]
+
+
+def summarize_file(vectorstore: Chroma, file_hash: str, chunk_ids: List[str]) -> List[Tuple[int, np.ndarray, int]]:
+    """``(section, vector, chunk count)`` rows for one file, the document row first.
+
+    The file's chunks are read back by ID in batches, so only the running
+    sums are held. Chunks stored before they recorded their sections get
+    the file's section field on the way.
+    """
+    key = section_key(file_hash)
+    sums: Dict[int, np.ndarray] = {}
+    counts: Dict[int, int] = {}
+    for start in range(0, len(chunk_ids), READ_BATCH):
+        page = vectorstore.get(ids=chunk_ids[start:start + READ_BATCH], include=["embeddings", "metadatas"])
+        if not page["ids"]:
+            continue
+        vectors = _normalise(np.asarray(page["embeddings"], dtype=np.float32))
+        untagged: Dict[str, int] = {}
+        for chunk_id, vector, metadata in zip(page["ids"], vectors, page["metadatas"]):
+            metadata = metadata or {}
+            section = section_of(_page_in(metadata, file_hash))
+            if metadata.get(key) != section:
+                untagged[chunk_id] = section
+            for level in (DOCUMENT_LEVEL, section):
+                if level in sums:
+                    sums[level] += vector
+                else:
+                    sums[level] = vector.copy()
+                counts[level] = counts.get(level, 0) + 1
+        if untagged:
+            vectorstore._collection.update(ids=list(untagged), metadatas=[{key: section} for section in untagged.values()])
+    return [(level, _normalise(sums[level]), counts[level]) for level in sorted(sums)]
+
+
+def update_summaries(
+    vectorstore: Chroma,
+    name: str,
+    files: Dict[str, dict],
+    stale: Iterable[str] = (),
+    persist_directory: str = PERSIST_DIRECTORY,
+) -> SummaryIndex:
+    """Bring a collection's summaries in line with its indexed ``files`` manifest and return them.
+
+    Files without summaries and ``stale`` files, whose chunks changed, are
+    read; summaries of files no longer indexed are dropped. Collections
+    indexed before summaries, or before chunks recorded their sections,
+    are filled in on first use.
+    """
+    path = summary_path(name, persist_directory)
+    with _locks_guard:
+        lock = _locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        summaries = load_summaries(name, persist_directory) or SummaryIndex.empty()
+        present = set(summaries.file_hashes.tolist())
+        stale = set(stale)
+        refresh = [file_hash for file_hash in files if file_hash not in present or file_hash in stale]
+        if not refresh and present <= set(files):
+            return summaries
+
+        keep_hashes = [file_hash for file_hash in files if file_hash not in refresh]
+        keep = np.isin(summaries.file_hashes, keep_hashes)
+        rows = []
+        for file_hash in refresh:
+            levels = summarize_file(vectorstore, file_hash, files[file_hash]["chunk_ids"])
+            rows.extend((file_hash, level, vector, count) for level, vector, count in levels)
+        vectors = [summaries.vectors[keep]] if keep.any() else []
+        if rows:
+            vectors.append(np.stack([vector for _, _, vector, _ in rows]).astype(np.float32))
+        summaries = SummaryIndex(
+            np.concatenate([summaries.file_hashes[keep], np.array([row[0] for row in rows], dtype="U64")]),
+            np.concatenate([summaries.sections[keep], np.array([row[1] for row in rows], dtype=np.int32)]),
+            np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32),
+            np.concatenate([summaries.counts[keep], np.array([row[3] for row in rows], dtype=np.int32)]),
+        )
+        summaries.save(path)
+        _loaded[path] = (os.path.getmtime(path), summaries)
+        return summaries
+
+
+def load_summaries(name: str, persist_directory: str = PERSIST_DIRECTORY) -> Optional[SummaryIndex]:
+    """A collection's summaries, reused until the file changes; None if there are none yet."""
+    path = summary_path(name, persist_directory)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != modified:
+        try:
+            summaries = SummaryIndex.load(path)
+        except (OSError, KeyError, ValueError):
+            # Written by an older version; rebuilt by the caller
+            return None
+        cached = _loaded[path] = (modified, summaries)
+    return cached[1]
+
+
+class HierarchicalRetriever(BaseRetriever):
+    """Retriever that narrows a search to the best sections before ranking chunks."""
+
+    vectorstore: Chroma
+    embeddings: Embeddings
+    summaries: object
+    documents: int = HIERARCHY_DOCUMENTS
+    sections: int = HIERARCHY_SECTIONS
+    k: int = 3
+    file_hashes: Optional[List[str]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = self.embeddings.embed_query(query)
+        query_vector = _normalise(np.asarray(vector, dtype=np.float32))
+        where = section_filter(self.summaries.select(query_vector, self.documents, self.sections, self.file_hashes))
+        if where is None:
+            return []
+        return self.vectorstore.similarity_search_by_vector(vector, k=self.k, filter=where)
+
+
+def get_retriever(
+    vectorstore: Chroma,
+    embeddings: Embeddings,
+    name: str,
+    files: Dict[str, dict],
+    documents: int = HIERARCHY_DOCUMENTS,
+    sections: int = HIERARCHY_SECTIONS,
+    k: int = 3,
+    only: Optional[List[str]] = None,
+    persist_directory: str = PERSIST_DIRECTORY,
+) -> Tuple[BaseRetriever, SummaryIndex]:
+    """Hierarchical retriever over the indexed ``files`` manifest plus its summaries.
+
+    ``only`` restricts both stages to some of the files.
+    """
+    summaries = update_summaries(vectorstore, name, files, persist_directory=persist_directory)
+    retriever = HierarchicalRetriever(
+        vectorstore=vectorstore,
+        embeddings=embeddings,
+        summaries=summaries,
+        documents=documents,
+        sections=sections,
+        k=k,
+        file_hashes=only or None,
+    )
+    return retriever, summaries
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from atomic_file import write_json
+from dedup import LSHIndex, drop_provenance, merge_provenance, provenance, signature, signatures
+from hierarchy import update_summaries
+from ingestion import CachedEmbeddings, IngestedFile, content_hash, should_stream
+from tracing import span
+from vector_store import (
+    PERSIST_DIRECTORY,
+    UPSERT_BATCH_SIZE,
+    delete_chunks,
+    index_manifest_path,
+    open_collection,
+    touch_collection,
+    upsert_chunks,
+)
+
+IngestFunction = Callable[[List[Tuple[str, bytes]]], Tuple[List[IngestedFile], List[Tuple[str, Exception]]]]
+StreamFunction = Callable[[str, bytes], Iterator[Tuple[List[Document], List[List[float]]]]]
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def document_set_hash(file_hashes: Iterable[str]) -> str:
+    """Order-independent identifier of a set of files."""
+    return hashlib.sha256("|".join(sorted(set(file_hashes))).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class IndexDelta:
+    """File hashes that a sync added, removed or left untouched."""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+class IndexManager:
+    """Keeps one persisted collection in sync with the current upload set.
+
+    A manifest next to the collection records which file hashes are indexed
+    and the chunk IDs each one references. ``sync`` only ingests files whose
+    hash is not indexed yet and releases the chunks of files that are gone.
+    New chunks are written before old ones are deleted, so the collection
+    stays queryable for the files already indexed while a delta is applied.
+    A chunk that nearly duplicates one already stored, per the collection's
+    MinHash LSH index, is not written: the file references the stored chunk,
+    whose provenance gains the copy. Chunks are deleted once no indexed file
+    references them.
+    Document and section summaries for hierarchical retrieval are updated
+    at the end of each sync.
+    """
+
+    def __init__(self, name: str, embeddings: Embeddings, persist_directory: str = PERSIST_DIRECTORY):
+        self.name = name
+        self.embeddings = embeddings
+        self.persist_directory = persist_directory
+        self.vectorstore = open_collection(name, embeddings, persist_directory)
+        self._manifest_path = index_manifest_path(name, persist_directory)
+        self._lsh_path = os.path.join(persist_directory, f"{name}.minhash.npz")
+        with _locks_guard:
+            self._lock = _locks.setdefault(os.path.abspath(self._manifest_path), threading.Lock())
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, files: Dict[str, dict]) -> None:
+        write_json(self._manifest_path, files)
+
+    @property
+    def files(self) -> Dict[str, dict]:
+        """Indexed files as ``{file_hash: {"name": ..., "chunk_ids": [...]}}``."""
+        return self._load()
+
+    @property
+    def refcounts(self) -> Dict[str, int]:
+        """How many indexed files reference each stored chunk."""
+        counts: Dict[str, int] = {}
+        for entry in self._load().values():
+            for chunk_id in entry["chunk_ids"]:
+                counts[chunk_id] = counts.get(chunk_id, 0) + 1
+        return counts
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.refcounts)
+
+    @property
+    def document_set(self) -> str:
+        """Identifier of the indexed document set; changes whenever a file is added or removed."""
+        return document_set_hash(self._load())
+
+    def diff(self, file_hashes: List[str]) -> IndexDelta:
+        indexed = self._load()
+        current = list(dict.fromkeys(file_hashes))
+        return IndexDelta(
+            added=[file_hash for file_hash in current if file_hash not in indexed],
+            removed=[file_hash for file_hash in indexed if file_hash not in current],
+            unchanged=[file_hash for file_hash in current if file_hash in indexed]
+        )
+
+    def _load_lsh(self, files: Dict[str, dict]) -> LSHIndex:
+        """The collection's near-duplicate index, rebuilt from stored text if it is missing."""
+        try:
+            return LSHIndex.load(self._lsh_path)
+        except (OSError, ValueError):
+            pass
+        lsh = LSHIndex()
+        if files:
+            offset = 0
+            while True:
+                page = self.vectorstore.get(include=["documents"], limit=UPSERT_BATCH_SIZE, offset=offset)
+                if not page["ids"]:
+                    break
+                for chunk_id, text in zip(page["ids"], page["documents"]):
+                    lsh.add(chunk_id, signature(text or ""))
+                offset += len(page["ids"])
+        return lsh
+
+    def _update_metadata(self, ids: List[str], change: Callable[[str, dict], dict]) -> None:
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            stored = self.vectorstore.get(ids=ids[start:start + UPSERT_BATCH_SIZE], include=["metadatas"])
+            if stored["ids"]:
+                self.vectorstore._collection.update(
+                    ids=stored["ids"],
+                    metadatas=[change(chunk_id, metadata or {}) for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])]
+                )
+
+    def _store(
+        self, writer, chunks: List[Document], chunk_signatures: Optional[list], lsh: LSHIndex, shared: Set[str]
+    ) -> List[str]:
+        """Write ``chunks``, collapsing near-duplicates of stored ones; returns the chunk IDs referenced.
+
+        Stored chunks that gain a copy are added to ``shared``.
+        """
+        if chunk_signatures is None:
+            chunk_signatures = signatures(chunks)
+        new: Dict[str, Document] = {}
+        copies: Dict[str, List[dict]] = {}
+        referenced: List[str] = []
+        for chunk, sig in zip(chunks, chunk_signatures):
+            chunk_id = chunk.metadata["chunk_id"]
+            match = lsh.query(sig)
+            if match is None or match[0] == chunk_id:
+                new[chunk_id] = chunk
+                lsh.add(chunk_id, sig)
+                referenced.append(chunk_id)
+            elif match[0] in new:
+                merge_provenance(new[match[0]].metadata, provenance(chunk.metadata))
+                referenced.append(match[0])
+            else:
+                copies.setdefault(match[0], []).extend(provenance(chunk.metadata))
+                referenced.append(match[0])
+        upsert_chunks(writer, list(new.values()))
+        if copies:
+            def add_copies(chunk_id: str, metadata: dict) -> dict:
+                merge_provenance(metadata, copies[chunk_id])
+                return metadata
+            self._update_metadata(list(copies), add_copies)
+            shared.update(copies)
+        return list(dict.fromkeys(referenced))
+
+    def _release(
+        self, file_hash: str, chunk_ids: List[str], files: Dict[str, dict], lsh: LSHIndex, shared: Set[str]
+    ) -> None:
+        """Drop ``file_hash``'s references: delete chunks nothing else references, update the rest's provenance.
+
+        Chunks other files still reference are added to ``shared``.
+        """
+        still_referenced = {chunk_id for entry in files.values() for chunk_id in entry["chunk_ids"]}
+        orphaned = [chunk_id for chunk_id in chunk_ids if chunk_id not in still_referenced]
+        kept = [chunk_id for chunk_id in chunk_ids if chunk_id in still_referenced]
+        delete_chunks(self.vectorstore, orphaned)
+        lsh.remove(orphaned)
+        self._update_metadata(kept, lambda chunk_id, metadata: drop_provenance(metadata, file_hash))
+        shared.update(kept)
+
+    def _save_all(self, files: Dict[str, dict], lsh: LSHIndex) -> None:
+        self._save(files)
+        lsh.save(self._lsh_path)
+
+    def _write_stream(
+        self,
+        name: str,
+        file_hash: str,
+        batches: Iterator[Tuple[List[Document], List[List[float]]]],
+        files: Dict[str, dict],
+        lsh: LSHIndex,
+        shared: Set[str],
+    ) -> List[str]:
+        """Store streamed ``(chunks, vectors)`` batches as they arrive; returns the chunk IDs referenced.
+
+        If the stream fails part-way, the file's references are released
+        so a retry starts from a clean collection.
+        """
+        written: List[str] = []
+        embedder = CachedEmbeddings(self.embeddings, [])
+        writer = open_collection(self.name, embedder, self.persist_directory)
+        try:
+            for chunks, vectors in batches:
+                embedder.serve([IngestedFile(name=name, file_hash=file_hash, chunks=chunks, vectors=vectors)])
+                with span("vector_upsert", file=name, chunks=len(chunks)):
+                    written.extend(self._store(writer, chunks, None, lsh, shared))
+        except BaseException:
+            # Also covers cancellation, which is not an Exception
+            self._release(file_hash, list(dict.fromkeys(written)), files, lsh, shared)
+            lsh.save(self._lsh_path)
+            raise
+        return list(dict.fromkeys(written))
+
+    def sync(
+        self, uploads: List[Tuple[str, bytes]], ingest: IngestFunction, stream: Optional[StreamFunction] = None
+    ) -> Tuple[IndexDelta, List[Tuple[str, Exception]]]:
+        """Bring the collection in line with ``(name, bytes)`` uploads.
+
+        ``ingest`` is only called with the uploads that are not indexed yet and
+        returns ingested files plus ``(name, error)`` pairs for failures. When
+        ``stream`` is given, new files long enough to need it are written batch
+        by batch from ``stream(name, data)`` instead.
+        """
+        by_hash = {}
+        for name, data in uploads:
+            by_hash.setdefault(content_hash(data), (name, data))
+
+        errors: List[Tuple[str, Exception]] = []
+        # Stored chunks whose set of referencing files changed; those files' summaries are rebuilt
+        shared: Set[str] = set()
+        with self._lock:
+            touch_collection(self.name, self.persist_directory)
+            delta = self.diff(list(by_hash))
+            files = self._load()
+            streamed = [
+                file_hash for file_hash in delta.added
+                if stream is not None and should_stream(by_hash[file_hash][1])
+            ]
+            regular = [file_hash for file_hash in delta.added if file_hash not in streamed]
+            lsh = self._load_lsh(files) if delta.changed else None
+            if regular:
+                ingested, errors = ingest([by_hash[file_hash] for file_hash in regular])
+                writer = open_collection(self.name, CachedEmbeddings(self.embeddings, ingested), self.persist_directory)
+                for entry in ingested:
+                    with span("vector_upsert", file=entry.name, chunks=len(entry.chunks)):
+                        chunk_ids = self._store(writer, entry.chunks, entry.signatures, lsh, shared)
+                    files[entry.file_hash] = {"name": entry.name, "chunk_ids": chunk_ids}
+                    self._save_all(files, lsh)
+            for file_hash in streamed:
+                name, data = by_hash[file_hash]
+                try:
+                    chunk_ids = self._write_stream(name, file_hash, stream(name, data), files, lsh, shared)
+                except Exception as e:
+                    errors.append((name, e))
+                    continue
+                files[file_hash] = {"name": name, "chunk_ids": chunk_ids}
+                self._save_all(files, lsh)
+            for file_hash in delta.removed:
+                removed = files.pop(file_hash)
+                self._release(file_hash, removed["chunk_ids"], files, lsh, shared)
+                self._save_all(files, lsh)
+            if delta.changed:
+                with span("summarize", files=len(files)):
+                    stale = [file_hash for file_hash, entry in files.items() if shared.intersection(entry["chunk_ids"])]
+                    update_summaries(self.vectorstore, self.name, files, stale, self.persist_directory)
+        return delta, errors
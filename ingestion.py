@@ -0,0 +1,500 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from dedup import collapse_duplicates, section_fields
+from pdf_extract import extract_pages, extract_shared_pages, page_count
+from settings import CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_MODEL, MAX_WORKERS
+from tracing import span
+
+# Parallel extraction settings (the worker count default lives in settings)
+PAGES_PER_TASK = 50
+
+# Streaming ingestion settings: files with at least STREAM_MIN_PAGES pages are
+# parsed, split, embedded and written in fixed-size batches rather than whole
+STREAM_MIN_PAGES = 500
+STREAM_BATCH_CHUNKS = 256
+STREAM_QUEUE_DEPTH = 2
+
+
+@dataclass
+class IngestedFile:
+    """Parsed pages, chunks and chunk vectors for one uploaded PDF.
+
+    ``signatures`` holds the chunks' MinHash signatures when they were
+    computed at ingestion.
+    """
+    name: str
+    file_hash: str
+    pages: List[Document] = field(default_factory=list)
+    chunks: List[Document] = field(default_factory=list)
+    vectors: List[List[float]] = field(default_factory=list)
+    signatures: Optional[list] = None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_id(file_hash: str, page: int, offset: int) -> str:
+    """Stable ID for a chunk, derived from its document hash, page and offset."""
+    return f"{file_hash[:32]}-{page}-{offset}"
+
+
+def cache_key(file_hash: str, chunk_size: int, chunk_overlap: int, model_name: str) -> str:
+    return f"{file_hash}:{chunk_size}:{chunk_overlap}:{model_name}"
+
+
+class IngestionCache:
+    """Process-wide LRU of ingested files keyed by content hash and settings.
+
+    Entries survive across reruns and user sessions.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[IngestedFile]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: IngestedFile) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+ingestion_cache = IngestionCache()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Process-wide pool of MAX_WORKERS extraction processes, started on first use.
+
+    The pool is never resized or shut down while callers may be using it;
+    each call limits how many of its own tasks are in flight instead.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork, so workers do not inherit this process's
+            # threads or loaded models. Each worker still re-imports the main
+            # module before it takes tasks, which makes the first use slow.
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def extraction_pool_started() -> bool:
+    return _pool is not None
+
+
+def warm_extraction_pool() -> List[int]:
+    """Start every extraction worker now, so the first upload does not pay for it; returns their PIDs."""
+    pool = get_extraction_pool()
+    return sorted({future.result() for future in [pool.submit(os.getpid) for _ in range(MAX_WORKERS)]})
+
+
+def extraction_worker_pids() -> List[int]:
+    """PIDs of the extraction workers currently running, for memory reporting."""
+    with _pool_lock:
+        pool = _pool
+    # ProcessPoolExecutor does not expose its processes publicly
+    return list(getattr(pool, "_processes", None) or {}) if pool is not None else []
+
+
+def _share(data: bytes) -> shared_memory.SharedMemory:
+    """Copy a PDF into shared memory once, so extraction tasks carry its name instead of a pickled copy."""
+    memory = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    memory.buf[:len(data)] = data
+    return memory
+
+
+def _unshare(memory: shared_memory.SharedMemory) -> None:
+    memory.close()
+    memory.unlink()
+
+
+def _discard_extraction_pool(pool: ProcessPoolExecutor) -> None:
+    """Forget a broken pool so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def make_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+        add_start_index=True
+    )
+
+
+def split_pages(
+    file_hash: str, pages: List[Document], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+) -> List[Document]:
+    """Split pages into chunks tagged with their file hash, section and stable chunk ID."""
+    chunks = make_splitter(chunk_size, chunk_overlap).split_documents(pages)
+    for chunk in chunks:
+        chunk.metadata["file_hash"] = file_hash
+        chunk.metadata["chunk_id"] = chunk_id(
+            file_hash, chunk.metadata.get("page", 0), chunk.metadata.get("start_index", 0)
+        )
+        chunk.metadata.update(section_fields(chunk.metadata))
+    return chunks
+
+
+def split_and_embed(
+    name: str,
+    file_hash: str,
+    pages: List[Document],
+    embeddings: Embeddings,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> IngestedFile:
+    with span("split", file=name, pages=len(pages)) as record:
+        chunks = split_pages(file_hash, pages, chunk_size, chunk_overlap)
+        record["chunks"] = len(chunks)
+    # Near-duplicates within the file are dropped before they cost an embedding
+    with span("dedup", file=name, chunks=len(chunks)) as record:
+        chunks, signatures = collapse_duplicates(chunks)
+        record["kept"] = len(chunks)
+    with span("embed", file=name, chunks=len(chunks)):
+        vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks]) if chunks else []
+    return IngestedFile(name=name, file_hash=file_hash, pages=pages, chunks=chunks, vectors=vectors, signatures=signatures)
+
+
+def extract_files(
+    files: List[Tuple[str, bytes]],
+    max_workers: int = MAX_WORKERS,
+    pages_per_task: int = PAGES_PER_TASK,
+    on_progress: Optional[Callable[[int, int, str], None]] = None,
+) -> Tuple[Dict[int, List[Document]], Dict[int, Exception]]:
+    """Extract pages from ``(name, bytes)`` pairs, splitting large files into page ranges.
+
+    At most ``max_workers`` ranges are extracted at once, and a file is
+    held in shared memory only while its ranges are. A single file
+    shorter than STREAM_MIN_PAGES is extracted in this process unless the
+    pool is already running, so a small upload does not wait for worker
+    processes to start. Returns pages and errors keyed by the file's
+    position in ``files``; pages always come back in document order
+    regardless of completion order.
+    """
+    pages: Dict[int, List[Document]] = {}
+    errors: Dict[int, Exception] = {}
+    ranges: Dict[int, Dict[int, List[Document]]] = {}
+    tasks = []
+    total_pages = 0
+    for index, (name, data) in enumerate(files):
+        try:
+            total = page_count(data)
+        except Exception as e:
+            errors[index] = e
+            continue
+        total_pages += total
+        ranges[index] = {}
+        for start in range(0, max(total, 1), pages_per_task):
+            tasks.append((index, start, min(start + pages_per_task, total)))
+
+    remaining = {index: sum(1 for task in tasks if task[0] == index) for index in ranges}
+    done = 0
+
+    def finish(index: int, start: int, result: Optional[List[Document]], error: Optional[Exception]):
+        nonlocal done
+        if index in errors:
+            return
+        if error is not None:
+            errors[index] = error
+        else:
+            ranges[index][start] = result
+            remaining[index] -= 1
+            if remaining[index]:
+                return
+            pages[index] = [page for key in sorted(ranges[index]) for page in ranges[index][key]]
+        done += 1
+        if on_progress:
+            on_progress(done, len(ranges), files[index][0])
+
+    small = len(ranges) == 1 and total_pages < STREAM_MIN_PAGES and not extraction_pool_started()
+    if max_workers <= 1 or len(tasks) <= 1 or small:
+        for index, start, end in tasks:
+            try:
+                finish(index, start, extract_pages(files[index][1], files[index][0], start, end), None)
+            except Exception as e:
+                finish(index, start, None, e)
+    else:
+        pool = get_extraction_pool()
+        waiting = iter(tasks)
+        futures = {}
+        shared: Dict[int, shared_memory.SharedMemory] = {}
+
+        def submit_next() -> None:
+            for index, start, end in waiting:
+                if index in errors:
+                    continue
+                name, data = files[index]
+                try:
+                    if index not in shared:
+                        shared[index] = _share(data)
+                    futures[pool.submit(extract_shared_pages, shared[index].name, len(data), name, start, end)] = (index, start)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    # The pool broke, or was replaced, while this call was running
+                    finish(index, start, None, e)
+                    continue
+                return
+
+        for _ in range(max_workers):
+            submit_next()
+        try:
+            while futures:
+                completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    index, start = futures.pop(future)
+                    try:
+                        finish(index, start, future.result(), None)
+                    except BrokenProcessPool as e:
+                        _discard_extraction_pool(pool)
+                        finish(index, start, None, e)
+                    except Exception as e:
+                        finish(index, start, None, e)
+                    if (index in pages or index in errors) and index in shared:
+                        _unshare(shared.pop(index))
+                    submit_next()
+        finally:
+            # Only matters when on_progress aborted the run, e.g. a cancelled job
+            for future in futures:
+                future.cancel()
+            for memory in shared.values():
+                _unshare(memory)
+    return pages, errors
+
+
+def ingest_files(
+    files: List[Tuple[str, bytes]],
+    embeddings: Embeddings,
+    model_name: str = EMBEDDING_MODEL,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    max_workers: int = MAX_WORKERS,
+    pages_per_task: int = PAGES_PER_TASK,
+    on_progress: Optional[Callable[[int, int, str], None]] = None,
+    cache: IngestionCache = ingestion_cache,
+) -> Tuple[List[IngestedFile], List[Tuple[str, Exception]]]:
+    """Parse, split and embed ``(name, bytes)`` uploads, reusing cached results.
+
+    Files missing from the cache are extracted in parallel. Returns the
+    ingested files in upload order and a ``(name, error)`` list for failures.
+    """
+    entries: List[Optional[IngestedFile]] = [None] * len(files)
+    pending = []
+    for index, (name, data) in enumerate(files):
+        file_hash = content_hash(data)
+        cached = cache.get(cache_key(file_hash, chunk_size, chunk_overlap, model_name))
+        if cached is not None:
+            entries[index] = cached
+        else:
+            pending.append((index, name, data, file_hash))
+
+    errors: Dict[int, Exception] = {}
+    if pending:
+        with span("pdf_load", files=len(pending)) as record:
+            pages, failed = extract_files(
+                [(name, data) for _, name, data, _ in pending],
+                max_workers=max_workers,
+                pages_per_task=pages_per_task,
+                on_progress=on_progress
+            )
+            record["pages"] = sum(len(file_pages) for file_pages in pages.values())
+
+        for position, (index, name, _, file_hash) in enumerate(pending):
+            if position in failed:
+                errors[index] = failed[position]
+                continue
+            try:
+                entry = split_and_embed(name, file_hash, pages[position], embeddings, chunk_size, chunk_overlap)
+            except Exception as e:
+                errors[index] = e
+                continue
+            cache.put(cache_key(file_hash, chunk_size, chunk_overlap, model_name), entry)
+            entries[index] = entry
+
+    return (
+        [entry for entry in entries if entry is not None],
+        [(files[index][0], errors[index]) for index in sorted(errors)]
+    )
+
+
+class CachedEmbeddings(Embeddings):
+    """Serves chunk vectors computed at ingestion time, delegating anything else."""
+
+    def __init__(self, base: Embeddings, ingested: List[IngestedFile]):
+        self.base = base
+        self.serve(ingested)
+
+    def serve(self, ingested: List[IngestedFile]) -> None:
+        """Serve these files' vectors in place of the previous ones."""
+        self._vectors = {}
+        for entry in ingested:
+            for chunk, vector in zip(entry.chunks, entry.vectors):
+                self._vectors[chunk.page_content] = vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = [text for text in texts if text not in self._vectors]
+        if missing:
+            for text, vector in zip(missing, self.base.embed_documents(missing)):
+                self._vectors[text] = vector
+        return [self._vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+
+def should_stream(data: bytes, min_pages: int = STREAM_MIN_PAGES) -> bool:
+    try:
+        return page_count(data) >= min_pages
+    except Exception:
+        # Unreadable files take the regular path, which reports the error
+        return False
+
+
+def iter_page_ranges(
+    name: str, data: bytes, total: int, max_workers: int = MAX_WORKERS, pages_per_task: int = PAGES_PER_TASK
+) -> Iterator[List[Document]]:
+    """Yield a file's pages one range at a time, in order.
+
+    At most ``max_workers`` ranges are being extracted ahead of the consumer,
+    so parsed pages never pile up faster than they are used. Workers read
+    the file from one shared memory copy rather than one per range.
+    """
+    starts = range(0, total, pages_per_task)
+    if max_workers <= 1:
+        for start in starts:
+            yield extract_pages(data, name, start, start + pages_per_task)
+        return
+    pool = get_extraction_pool()
+    memory = _share(data)
+    pending = deque()
+    try:
+        for start in starts:
+            pending.append(pool.submit(extract_shared_pages, memory.name, len(data), name, start, start + pages_per_task))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _discard_extraction_pool(pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+        _unshare(memory)
+
+
+def stream_file(
+    name: str,
+    data: bytes,
+    embeddings: Embeddings,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    batch_size: int = STREAM_BATCH_CHUNKS,
+    max_workers: int = MAX_WORKERS,
+    pages_per_task: int = PAGES_PER_TASK,
+    on_progress: Optional[Callable[[int, int, str], None]] = None,
+    queue_depth: int = STREAM_QUEUE_DEPTH,
+) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+    """Yield ``(chunks, vectors)`` batches of one PDF without holding the whole file's text.
+
+    A background thread extracts and splits page ranges into batches of
+    ``batch_size`` chunks and blocks once ``queue_depth`` batches wait to be
+    embedded; the caller embeds and stores one batch before pulling the next.
+    Memory therefore depends on the batch size, not on the document length.
+    ``on_progress`` is called from the caller's thread with pages done so far.
+    """
+    file_hash = content_hash(data)
+    total = page_count(data)
+    batches = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            batch, pages_done = [], 0
+            with closing(iter_page_ranges(name, data, total, max_workers, pages_per_task)) as ranges:
+                for pages in ranges:
+                    pages_done += len(pages)
+                    with span("split", file=name, pages=len(pages)) as record:
+                        chunks = split_pages(file_hash, pages, chunk_size, chunk_overlap)
+                        record["chunks"] = len(chunks)
+                    batch.extend(chunks)
+                    while len(batch) >= batch_size:
+                        if not put((batch[:batch_size], pages_done)):
+                            return
+                        batch = batch[batch_size:]
+            if batch and not put((batch, pages_done)):
+                return
+            put(finished)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name=f"stream-{file_hash[:8]}", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            chunks, pages_done = item
+            with span("dedup", file=name, chunks=len(chunks)) as record:
+                chunks, _ = collapse_duplicates(chunks)
+                record["kept"] = len(chunks)
+            with span("embed", file=name, chunks=len(chunks)):
+                vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+            yield chunks, vectors
+            if on_progress:
+                on_progress(pages_done, total, name)
+    finally:
+        stop.set()
+        producer.join()
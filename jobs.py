@@ -0,0 +1,145 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, Set
+
+# Background jobs shared by every session in the process. Long work
+# submitted here keeps running across reruns instead of being restarted by
+# them.
+JOB_WORKERS = 2
+MAX_FINISHED_JOBS = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job once it has been cancelled.
+
+    Derives from BaseException so that ``except Exception`` handlers in the
+    ingestion code, which record per-file errors, do not swallow it.
+    """
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    group: Optional[str] = None
+    state: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        """Stop the job here if it has been cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, progress: float, message: str = "") -> None:
+        """Record progress from inside the job; also a cancellation point."""
+        self.check()
+        self.progress = max(0.0, min(1.0, progress))
+        if message:
+            self.message = message
+
+
+class JobManager:
+    """Thread-pool job runner with per-key deduplication.
+
+    Submitting a key that already has a queued or running job returns that
+    job instead of starting another. Submitting into a ``group`` cancels the
+    group's active jobs for other keys, as they have been superseded.
+    Cancellation is cooperative: the job stops at its next ``report`` or
+    ``check`` call.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable[[Job], Any], group: Optional[str] = None) -> Job:
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.key == key and job.active:
+                    return job
+            for job in self._jobs.values():
+                if group is not None and job.group == group and job.active:
+                    job._cancel.set()
+            job = Job(id=f"job-{next(self._ids)}", key=key, group=group)
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]) -> None:
+        try:
+            job.check()
+            job.state = RUNNING
+            job.result = fn(job)
+            job.state = DONE
+            job.progress = 1.0
+        except JobCancelled:
+            job.state = CANCELLED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = FAILED
+        finally:
+            job.finished = time.time()
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def latest(self, key: str) -> Optional[Job]:
+        """Most recently submitted job for ``key``, whatever its state."""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.key == key:
+                    return job
+        return None
+
+    def active_groups(self) -> Set[str]:
+        """Groups with a queued or running job."""
+        with self._lock:
+            return {job.group for job in self._jobs.values() if job.active and job.group is not None}
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        job._cancel.set()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {state: states.count(state) for state in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+
+
+job_manager = JobManager()
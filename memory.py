@@ -0,0 +1,139 @@
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import Runnable
+
+from context import count_message_tokens
+from settings import HISTORY_TOKEN_WINDOW
+from transcript import add_html
+
+# Older messages are only folded into the summary once this many have left
+# the window, so the summarizer runs every few turns rather than every turn.
+SUMMARY_BATCH_MESSAGES = 4
+
+SUMMARY_SYSTEM_PROMPT = """Condense the conversation below into a short summary that keeps every fact, figure, document reference and open question a follow-up might rely on. Extend the existing summary if there is one. Return only the summary."""
+
+
+def build_summarizer(llm: BaseLanguageModel) -> Runnable:
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_SYSTEM_PROMPT),
+        ("human", "Existing summary:\n{summary}"),
+        MessagesPlaceholder("messages")
+    ])
+    return prompt | llm | StrOutputParser()
+
+
+def is_summary(message: BaseMessage) -> bool:
+    return bool(message.additional_kwargs.get("history_summary"))
+
+
+class WindowedChatHistory(BaseChatMessageHistory):
+    """Bounded view over a chat history that keeps every message in ``store``.
+
+    ``messages``, which is what the prompts see, returns the most recent turns
+    that fit in ``max_tokens``, preceded by a rolling summary of older turns
+    when a ``summarizer`` is set. ``transcript`` returns the full conversation
+    for display, and ``transcript_page`` just its newest messages. Message
+    bodies are escaped for display as they are added. Summaries are appended
+    to the store as marked system messages, so any append-only backend can
+    hold them.
+    """
+
+    def __init__(self, store: BaseChatMessageHistory, max_tokens: int = HISTORY_TOKEN_WINDOW, summarizer: Optional[Runnable] = None):
+        self.store = store
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+
+    def _split(self, stored: Sequence[BaseMessage]):
+        """Latest summary, the conversation messages, and how many of them it covers.
+
+        Coverage is tracked by message ID rather than position, so it stays
+        correct when the store only loads its most recent messages.
+        """
+        summary = None
+        conversation = []
+        for message in stored:
+            if is_summary(message):
+                summary = message
+            else:
+                conversation.append(message)
+        covered = 0
+        if summary is not None:
+            covers_id = summary.additional_kwargs.get("covers_id")
+            for index, message in enumerate(conversation):
+                if message.id == covers_id:
+                    covered = index + 1
+                    break
+        return summary, conversation, covered
+
+    def _window_start(self, conversation: List[BaseMessage], covered: int) -> int:
+        start = len(conversation)
+        used = 0
+        while start > covered:
+            cost = count_message_tokens([conversation[start - 1]])
+            if used + cost > self.max_tokens:
+                break
+            used += cost
+            start -= 1
+        # Never open the window on an answer whose question was dropped
+        while start < len(conversation) and conversation[start].type != "human":
+            start += 1
+        return start
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        summary, conversation, covered = self._split(self.store.messages)
+        window = conversation[self._window_start(conversation, covered):]
+        if summary is None:
+            return window
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary.content}")] + window
+
+    @property
+    def transcript(self) -> List[BaseMessage]:
+        return self._split(self.store.messages)[1]
+
+    def transcript_page(self, limit: int) -> Tuple[List[BaseMessage], bool]:
+        """Newest ``limit`` stored messages for display, and whether older ones exist.
+
+        Stores with a ``latest`` method are asked for just that many, so a
+        page can reach past what ``messages`` loads.
+        """
+        latest = getattr(self.store, "latest", None)
+        stored = latest(limit + 1) if latest is not None else self.store.messages[-(limit + 1):]
+        return [message for message in stored[-limit:] if not is_summary(message)], len(stored) > limit
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        for message in messages:
+            if not message.id:
+                message.id = uuid.uuid4().hex
+            add_html(message)
+        self.store.add_messages(messages)
+        if self.summarizer is not None:
+            self._summarize()
+
+    def _summarize(self) -> None:
+        summary, conversation, covered = self._split(self.store.messages)
+        start = self._window_start(conversation, covered)
+        if start - covered < SUMMARY_BATCH_MESSAGES:
+            return
+        try:
+            text = self.summarizer.invoke({
+                "summary": summary.content if summary else "(none)",
+                "messages": conversation[covered:start]
+            })
+        except Exception:
+            # The turn itself is already stored; the next turn retries the summary
+            return
+        self.store.add_message(SystemMessage(
+            content=text,
+            id=uuid.uuid4().hex,
+            additional_kwargs={"history_summary": True, "covers_id": conversation[start - 1].id}
+        ))
+
+    def clear(self) -> None:
+        self.store.clear()
@@ -0,0 +1,75 @@
+import io
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple, Union
+
+import pypdf
+from langchain_core.documents import Document
+
+# Page-level PDF text extraction. Kept free of heavy imports so that worker
+# processes in the extraction pool start quickly. Documents mirror what
+# PyPDFLoader produces: one per page with the PDF metadata plus source,
+# total_pages, page and page_label.
+
+# The PDF a worker last opened from shared memory, so the later page ranges
+# of the same file it is handed do not parse it again
+_shared_reader: Optional[Tuple[str, pypdf.PdfReader]] = None
+
+
+def pdf_metadata(reader: pypdf.PdfReader, source: str) -> dict:
+    metadata = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+    for key, value in (reader.metadata or {}).items():
+        key = key.lstrip("/").lower()
+        value = value if isinstance(value, (str, int)) else str(value)
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+    metadata["source"] = source
+    metadata["total_pages"] = len(reader.pages)
+    return metadata
+
+
+def open_pdf(data: Union[bytes, memoryview]) -> pypdf.PdfReader:
+    """Open a PDF straight from memory; no temporary file is written."""
+    return pypdf.PdfReader(io.BytesIO(data))
+
+
+def page_count(data: Union[bytes, memoryview]) -> int:
+    return len(open_pdf(data).pages)
+
+
+def extract_pages(
+    data: Union[bytes, memoryview], source: str, start: int = 0, end: Optional[int] = None
+) -> List[Document]:
+    """Extract pages ``start`` to ``end`` (exclusive) of one in-memory PDF as Documents."""
+    return read_pages(open_pdf(data), source, start, end)
+
+
+def extract_shared_pages(segment: str, size: int, source: str, start: int = 0, end: Optional[int] = None) -> List[Document]:
+    """``extract_pages`` for a PDF of ``size`` bytes that the caller placed in a shared memory segment."""
+    global _shared_reader
+    if _shared_reader is None or _shared_reader[0] != segment:
+        memory = shared_memory.SharedMemory(name=segment)
+        try:
+            data = bytes(memory.buf[:size])
+        finally:
+            memory.close()
+        _shared_reader = (segment, open_pdf(data))
+    return read_pages(_shared_reader[1], source, start, end)
+
+
+def read_pages(reader: pypdf.PdfReader, source: str, start: int = 0, end: Optional[int] = None) -> List[Document]:
+    metadata = pdf_metadata(reader, source)
+    end = len(reader.pages) if end is None else min(end, len(reader.pages))
+    return [
+        Document(
+            page_content=reader.pages[number].extract_text().strip(),
+            metadata=dict(metadata, page=number, page_label=reader.page_labels[number])
+        )
+        for number in range(start, end)
+    ]
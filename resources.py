@@ -0,0 +1,90 @@
+import hashlib
+import threading
+import time
+from typing import Dict
+
+import httpx
+from langchain_groq import ChatGroq
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from embedding_cache import MAX_BATCH_SIZE, BatchedEmbeddings, VectorCache
+from ingestion import EMBEDDING_MODEL
+
+# Shared, process-wide resources: models and HTTP clients built here are
+# created once per process, not once per rerun or session.
+
+LLM_MODEL = "Llama3-8b-8192"
+LLM_TEMPERATURE = 0.3
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+HTTP_TIMEOUT = 60.0
+
+_embeddings: Dict[str, BatchedEmbeddings] = {}
+_http_clients: Dict[str, httpx.Client] = {}
+_http_async_clients: Dict[str, httpx.AsyncClient] = {}
+_llms: Dict[tuple, ChatGroq] = {}
+_load_times: Dict[str, float] = {}
+_embeddings_lock = threading.Lock()
+_llm_lock = threading.Lock()
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL) -> Embeddings:
+    """Shared embedding model, fronted by the persistent vector cache."""
+    with _embeddings_lock:
+        if model_name not in _embeddings:
+            started = time.perf_counter()
+            # BatchedEmbeddings picks the batch size, so let sentence-transformers
+            # encode each batch it is handed in one pass.
+            model = HuggingFaceEmbeddings(
+                model_name=model_name,
+                model_kwargs={'device': 'cpu'},
+                encode_kwargs={'normalize_embeddings': True, 'batch_size': MAX_BATCH_SIZE}
+            )
+            _embeddings[model_name] = BatchedEmbeddings(model, VectorCache(model_name))
+            _load_times[f"embeddings:{model_name}"] = time.perf_counter() - started
+        return _embeddings[model_name]
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+
+
+def get_llm(api_key: str, model_name: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE) -> ChatGroq:
+    """Return the ChatGroq client for this key, sharing one connection pool per API key."""
+    digest = _key_digest(api_key)
+    with _llm_lock:
+        if digest not in _http_clients:
+            _http_clients[digest] = httpx.Client(limits=_http_limits(), timeout=HTTP_TIMEOUT)
+            _http_async_clients[digest] = httpx.AsyncClient(limits=_http_limits(), timeout=HTTP_TIMEOUT)
+        key = (digest, model_name, temperature)
+        if key not in _llms:
+            _llms[key] = ChatGroq(
+                groq_api_key=api_key,
+                model_name=model_name,
+                temperature=temperature,
+                http_client=_http_clients[digest],
+                http_async_client=_http_async_clients[digest]
+            )
+        return _llms[key]
+
+
+def warm_up(model_name: str = EMBEDDING_MODEL) -> float:
+    """Load the embedding model and run one encode so the first query pays nothing extra."""
+    started = time.perf_counter()
+    get_embeddings(model_name).embed_query("warm up")
+    return time.perf_counter() - started
+
+
+def health() -> dict:
+    return {
+        "embedding_models": sorted(_embeddings),
+        "llm_clients": len(_llms),
+        "http_pools": len(_http_clients),
+        "load_seconds": dict(_load_times),
+        "cached_vectors": {name: len(model.cache) for name, model in _embeddings.items()},
+    }
@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+SESSION_DATABASE = "./sessions.db"
+# How many of the newest messages a history loads; older ones stay on disk
+RECENT_MESSAGES = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+"""
+
+_local = threading.local()
+
+
+def get_connection(database: str = SESSION_DATABASE) -> sqlite3.Connection:
+    """Per-thread connection in WAL mode, so readers never block the single writer."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    path = os.path.abspath(database)
+    if path not in connections:
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        connections[path] = connection
+    return connections[path]
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Chat history stored in a local SQLite database shared by all app processes.
+
+    Only the newest ``recent_messages`` are read, and they are cached until
+    this history writes again. Each ``add_messages`` call is one transaction.
+    """
+
+    def __init__(self, session_id: str, database: str = SESSION_DATABASE, recent_messages: int = RECENT_MESSAGES):
+        self.session_id = session_id
+        self.database = database
+        self.recent_messages = recent_messages
+        self._cache: Optional[List[BaseMessage]] = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._cache is None:
+            rows = get_connection(self.database).execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (self.session_id, self.recent_messages)
+            ).fetchall()
+            self._cache = messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+        return list(self._cache)
+
+    def latest(self, limit: int) -> List[BaseMessage]:
+        """Newest ``limit`` messages, read from disk only when that is more than ``messages`` holds."""
+        if limit <= self.recent_messages:
+            return self.messages[-limit:]
+        rows = get_connection(self.database).execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (self.session_id, limit)
+        ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        now = time.time()
+        connection = get_connection(self.database)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO messages (session_id, message, created) VALUES (?, ?, ?)",
+                [(self.session_id, json.dumps(message_to_dict(message)), now) for message in messages]
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._cache = None
+
+    def clear(self) -> None:
+        get_connection(self.database).execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+        self._cache = None
+
+    def count(self) -> int:
+        return get_connection(self.database).execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ?", (self.session_id,)
+        ).fetchone()[0]
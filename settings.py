@@ -0,0 +1,47 @@
+import importlib.util
+import os
+from typing import List
+
+# Defaults the sidebar needs before any model or vector store is loaded. This
+# module must stay free of third-party imports so the first page render does
+# not pay for LangChain, Chroma or PyTorch; the pipeline modules re-export
+# these values.
+#
+# Streamlit reruns app.py on every interaction, for every session, but keeps
+# imported modules loaded. Module-level state in the pipeline modules (caches
+# in ingestion and embedding_cache, models in resources, jobs in jobs) is
+# therefore built once per process and shared across reruns and sessions.
+
+# Ingestion
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CHUNK_SIZE = 5000
+CHUNK_OVERLAP = 500
+MAX_WORKERS = os.cpu_count() or 1
+
+# Retrieval and answering
+RETRIEVAL_K = 3
+CONTEXT_TOKEN_BUDGET = 3000
+SIMILARITY_THRESHOLD = 0.95
+HISTORY_TOKEN_WINDOW = 1500
+
+# Hierarchical retrieval: documents, then sections within them, searched per question
+HIERARCHY_DOCUMENTS = 5
+HIERARCHY_SECTIONS = 8
+# A section is a run of this many pages
+SECTION_PAGES = 10
+
+# Vector search backends
+BACKENDS = {
+    "chroma": "Chroma (default)",
+    "faiss-flat": "FAISS flat (exact)",
+    "faiss-hnsw": "FAISS HNSW",
+    "faiss-ivfpq": "FAISS IVF-PQ",
+    "faiss-ivfsq8": "FAISS IVF-SQ8 (int8)",
+}
+DEFAULT_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+
+def available_backends() -> List[str]:
+    """Backends usable in this environment, checked without importing faiss."""
+    has_faiss = importlib.util.find_spec("faiss") is not None
+    return [name for name in BACKENDS if name == "chroma" or has_faiss]
@@ -0,0 +1,134 @@
+"""Cold-start helpers for the PDF Insight Engine app.
+
+``prewarm`` imports the chat pipeline and loads the embedding model in a
+background thread, once per process, so a user landing on a fresh process
+does not wait for them on the first question. Run this module for an
+import-time profile of the first render and of the chat pipeline:
+
+    python startup.py
+    python startup.py --json
+"""
+import argparse
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Sequence
+
+# What the first page render imports, and what the Document Chat tab adds
+RENDER_MODULES = ("streamlit", "dotenv", "settings")
+PIPELINE_MODULES = ("resources", "index_manager", "faiss_index", "engine", "memory", "session_store", "chat")
+PREWARM = os.getenv("PREWARM_PIPELINE", "1") != "0"
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)")
+_status: Dict[str, object] = {}
+_started = False
+_lock = threading.Lock()
+
+
+def _load(warm_models: bool) -> None:
+    started = time.perf_counter()
+    try:
+        for name in PIPELINE_MODULES:
+            module_started = time.perf_counter()
+            importlib.import_module(name)
+            _status[f"import:{name}"] = time.perf_counter() - module_started
+        if warm_models:
+            from resources import warm_up
+            _status["embeddings"] = warm_up()
+    except Exception as e:
+        # The chat tab imports and loads on demand anyway
+        _status["error"] = f"{type(e).__name__}: {e}"
+    _status["total"] = time.perf_counter() - started
+
+
+def prewarm(warm_models: bool = True) -> bool:
+    """Start the background pre-warm unless it already ran; returns whether this call started it."""
+    global _started
+    with _lock:
+        if _started:
+            return False
+        _started = True
+    threading.Thread(target=_load, args=(warm_models,), name="prewarm", daemon=True).start()
+    return True
+
+
+def status() -> dict:
+    """Timings recorded by the pre-warm so far; ``total`` is set once it has finished."""
+    return dict(_status, started=_started)
+
+
+def profile_imports(stages: Sequence[Sequence[str]]) -> List[dict]:
+    """Import ``stages`` in order in a fresh interpreter and attribute ``-X importtime`` to them.
+
+    Each module's time is what it adds on top of earlier stages, as modules
+    already imported are free. ``packages`` sums self time per top-level package.
+    """
+    modules = [name for stage in stages for name in stage]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {name}" for name in modules)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    cumulative: Dict[str, float] = {}
+    packages: Dict[str, Dict[str, float]] = {}
+    pending: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]), match[4]
+        top = name.split(".")[0]
+        pending[top] = pending.get(top, 0.0) + self_us / 1e6
+        # A top-level import is logged after the nested imports it triggered
+        if indent == 1 and name in modules:
+            cumulative[name] = cumulative_us / 1e6
+            packages[name], pending = pending, {}
+
+    report = []
+    for stage in stages:
+        by_package: Dict[str, float] = {}
+        for name in stage:
+            for package, seconds in packages.get(name, {}).items():
+                by_package[package] = by_package.get(package, 0.0) + seconds
+        report.append({
+            "modules": {name: round(cumulative.get(name, 0.0), 4) for name in stage},
+            "seconds": round(sum(cumulative.get(name, 0.0) for name in stage), 4),
+            "packages": {
+                package: round(seconds, 4)
+                for package, seconds in sorted(by_package.items(), key=lambda item: -item[1])
+            },
+        })
+    return report
+
+
+def main(argv=None) -> List[dict]:
+    parser = argparse.ArgumentParser(description="Import-time profile of the app's first render and chat pipeline")
+    parser.add_argument("--top", type=int, default=10, help="packages listed per stage")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    report = profile_imports([RENDER_MODULES, PIPELINE_MODULES])
+    if args.json:
+        print(json.dumps(dict(zip(("first_render", "chat_pipeline"), report)), indent=2))
+        return report
+    for title, stage in zip(("First render", "Chat pipeline"), report):
+        print(f"{title}: {stage['seconds']:.3f}s")
+        for name, seconds in stage["modules"].items():
+            print(f"  {name:<20} {seconds:8.3f}s")
+        print("  slowest packages (self time):")
+        for package, seconds in list(stage["packages"].items())[:args.top]:
+            print(f"    {package:<18} {seconds:8.3f}s")
+    return report
+
+
+if __name__ == "__main__":
+    main()
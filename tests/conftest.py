@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    # Chains run under test write turn traces; keep them out of the working tree.
+    # Set before any test module imports tracing, which reads it once.
+    os.environ["TRACE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="pytest-traces-"), "traces.jsonl")
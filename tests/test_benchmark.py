@@ -0,0 +1,15 @@
+import json
+
+from benchmark import main
+
+
+def test_benchmark_reports_warmup_and_worker_memory(tmp_path):
+    output = tmp_path / "bench.json"
+    report = main(["--fake-embeddings", "--pages", "6", "--queries", "3", "--output", str(output)])
+
+    assert json.loads(output.read_text(encoding="utf-8")) == report
+    assert report["warmup"]["workers"] >= 1 and report["warmup"]["children_peak_rss_mb"] > 0
+    run = report["runs"][0]
+    assert list(run["stages"]) == ["sync", "backend", "retrieve", "answer"]
+    assert run["chunks"] > 0 and "pdf_load" in run["sync_spans"] and "embed" in run["sync_spans"]
+    assert all(values["children_peak_rss_mb"] > 0 for values in run["stages"].values())
@@ -0,0 +1,36 @@
+from langchain_core.documents import Document
+
+from context import ContextPacker, count_tokens, trim_to_sentences
+
+
+def test_pack_keeps_chunks_that_fit():
+    documents = [Document(page_content=f"Fact number {i} about the budget.") for i in range(3)]
+    assert ContextPacker(budget=1000).pack(documents, "budget") == documents
+
+
+def test_pack_trims_to_budget_around_best_match():
+    filler = " ".join(f"Sentence {i} is about nothing in particular." for i in range(200))
+    document = Document(page_content=filler + " The budget was approved in March. " + filler, metadata={"page": 1})
+    packed = ContextPacker(budget=200).pack([document], "When was the budget approved?")
+
+    assert len(packed) == 1
+    assert packed[0].metadata == {"page": 1, "trimmed": True}
+    assert "The budget was approved in March." in packed[0].page_content
+    assert count_tokens(packed[0].page_content) <= 200
+
+
+def test_pack_drops_overlap_with_higher_ranked_chunk():
+    first = Document(page_content="alpha beta gamma", metadata={"start_index": 0, "page": 0, "source": "x"})
+    second = Document(page_content="gamma delta", metadata={"start_index": 11, "page": 0, "source": "x"})
+    packed = ContextPacker(budget=1000).pack([first, second], "delta")
+
+    assert [doc.page_content for doc in packed] == ["alpha beta gamma", "delta"]
+
+
+def test_trim_to_sentences_cuts_oversized_sentence_to_words():
+    lines = [" ".join(f"w{row}x{column}" for column in range(12)) for row in range(40)]
+    lines[30] = "the refund policy applies within thirty days"
+    text = trim_to_sentences("\n".join(lines), "What is the refund policy?", 60)
+
+    assert "refund policy" in text
+    assert 0 < count_tokens(text) <= 60
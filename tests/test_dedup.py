@@ -0,0 +1,28 @@
+import json
+
+from langchain_core.documents import Document
+
+from dedup import collapse_duplicates
+
+BOILERPLATE = " ".join(f"term{i}" for i in range(60))
+
+
+def chunk(chunk_id, text, file_hash, page):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id, "file_hash": file_hash, "source": f"{file_hash}.pdf", "page": page})
+
+
+def test_collapse_duplicates_keeps_first_copy_with_provenance():
+    chunks = [
+        chunk("a-0", BOILERPLATE, "a", 0),
+        chunk("a-1", " ".join(f"alpha{i}" for i in range(60)), "a", 1),
+        chunk("b-3", BOILERPLATE + " trailing", "b", 3),
+    ]
+    kept, signatures = collapse_duplicates(chunks)
+
+    assert [doc.metadata["chunk_id"] for doc in kept] == ["a-0", "a-1"]
+    assert len(signatures) == 2
+    assert json.loads(kept[0].metadata["provenance"]) == [
+        {"file_hash": "a", "source": "a.pdf", "page": 0},
+        {"file_hash": "b", "source": "b.pdf", "page": 3},
+    ]
+    assert "provenance" not in kept[1].metadata
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import BatchedEmbeddings, VectorCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def vector(value, size=4):
+    return [float(value)] * size
+
+
+def test_put_and_get_round_trip_and_skip_known_keys(tmp_path):
+    cache = VectorCache("model", str(tmp_path))
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.put_many(["b", "c"], [vector(9), vector(3)])
+
+    assert cache.get_many(["a", "b", "c", "missing"]) == {"a": vector(1), "b": vector(2), "c": vector(3)}
+    assert len(cache) == 3
+
+
+def test_appends_from_another_process_are_picked_up(tmp_path):
+    cache = VectorCache("model", str(tmp_path))
+    cache.put_many(["a"], [vector(1)])
+    assert cache.get_many(["b"]) == {}
+
+    subprocess.run(
+        [sys.executable, "-c", (
+            "from embedding_cache import VectorCache; "
+            f"VectorCache('model', {str(tmp_path)!r}).put_many(['b'], [[2.0] * 4])"
+        )],
+        cwd=ROOT, check=True
+    )
+
+    assert cache.get_many(["a", "b"]) == {"a": vector(1), "b": vector(2)}
+    cache.put_many(["c"], [vector(3)])
+    assert VectorCache("model", str(tmp_path)).get_many(["a", "b", "c"]) == {"a": vector(1), "b": vector(2), "c": vector(3)}
+
+
+def test_interrupted_append_is_trimmed_and_partial_key_ignored(tmp_path):
+    cache = VectorCache("model", str(tmp_path))
+    cache.put_many(["a"], [vector(1)])
+    # Vectors written without their keys, as if the writer died between the two files
+    with open(os.path.join(cache.path, "vectors.f32"), "ab") as f:
+        f.write(np.full(4, 7, dtype=np.float32).tobytes())
+
+    cache.put_many(["b"], [vector(2)])
+    assert VectorCache("model", str(tmp_path)).get_many(["a", "b"]) == {"a": vector(1), "b": vector(2)}
+
+    # A key line still being written by another process is not read yet
+    with open(os.path.join(cache.path, "keys.txt"), "a", encoding="ascii") as f:
+        f.write("half")
+    assert len(VectorCache("model", str(tmp_path))) == 2
+
+
+def test_recent_query_vectors_are_reused_and_bounded(tmp_path):
+    embeddings = BatchedEmbeddings(DeterministicFakeEmbedding(size=8), VectorCache("model", str(tmp_path)), query_cache_size=2)
+    first = embeddings.embed_query("a")
+    embeddings.embed_query("b")
+    assert embeddings.embed_query("a") == first and embeddings.queries_reused == 1
+
+    # "b" is now the least recently used and makes way for "c"
+    embeddings.embed_query("c")
+    assert list(embeddings._queries) == ["a", "c"]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from answer_cache import answer_cache
+from embedding_cache import BatchedEmbeddings, VectorCache
+from engine import TokenBucket, build_rag_chain, run_batch
+from vector_store import open_collection
+
+
+async def collect(batch):
+    return [result async for result in batch]
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def acquire_all():
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Two tokens are free, the other four arrive at 20 a second
+    assert asyncio.run(acquire_all()) >= 0.18
+
+
+def test_run_batch_caps_concurrency_and_yields_in_completion_order():
+    running = peak = 0
+
+    async def answer(inputs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(float(inputs["input"]))
+        running -= 1
+        return {"answer": inputs["input"], "context": []}
+
+    chain = RunnableLambda(lambda inputs: None, afunc=answer)
+    questions = [("slow", "0.2"), ("fast", "0.01"), ("medium", "0.1"), ("quick", "0.02")]
+    results = asyncio.run(collect(run_batch(chain, questions, concurrency=2)))
+
+    assert peak == 2
+    # "quick" waits for a free slot, so it finishes after "medium" despite being shorter
+    assert [result["id"] for result in results] == ["fast", "medium", "quick", "slow"]
+    assert all(result["error"] is None for result in results)
+
+
+def test_run_batch_records_errors_without_stopping():
+    async def answer(inputs):
+        if inputs["input"] == "bad":
+            raise ValueError("no answer")
+        return {"answer": "ok", "context": []}
+
+    chain = RunnableLambda(lambda inputs: None, afunc=answer)
+    results = asyncio.run(collect(run_batch(chain, [("1", "good"), ("2", "bad")])))
+    by_id = {result["id"]: result for result in results}
+
+    assert by_id["1"]["answer"] == "ok"
+    assert by_id["2"]["answer"] is None
+    assert by_id["2"]["error"] == "ValueError: no answer"
+
+
+def test_run_batch_answers_with_rag_chain(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    vectorstore = open_collection("engine_test", embeddings, str(tmp_path))
+    vectorstore.add_documents(
+        [Document(page_content="Revenue grew by ten percent.", metadata={"source": "report.pdf", "page": 1, "chunk_id": "c1"})],
+        ids=["c1"]
+    )
+    llm = FakeListChatModel(responses=["Ten percent."])
+    chain = build_rag_chain(llm, vectorstore, embeddings, "documents", k=1)
+
+    results = asyncio.run(collect(run_batch(chain, [("q1", "How much did revenue grow?")])))
+
+    assert results[0]["answer"] == "Ten percent."
+    assert results[0]["sources"] == [{"source": "report.pdf", "page": 1, "chunk_id": "c1"}]
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    queries: int = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def test_turn_embeds_the_question_once_for_retrieval_and_answer_cache(tmp_path):
+    base = CountingEmbedding(size=32)
+    embeddings = BatchedEmbeddings(base, VectorCache("fake", str(tmp_path / "vectors")))
+    vectorstore = open_collection("engine_turn_test", embeddings, str(tmp_path))
+    vectorstore.add_documents([Document(page_content="Revenue grew by ten percent.", metadata={"chunk_id": "c1"})], ids=["c1"])
+    chain = build_rag_chain(FakeListChatModel(responses=["Ten percent."]), vectorstore, embeddings, "turn_test", k=1)
+    hits = answer_cache.hits
+
+    for _ in range(2):
+        assert chain.invoke({"input": "How much did revenue grow?", "chat_history": []})["answer"] == "Ten percent."
+
+    # Retrieval embeds the question; the cache lookup and the repeat reuse that vector
+    assert base.queries == 1 and embeddings.queries_reused == 3
+    assert answer_cache.hits == hits + 1
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from faiss_index import (
+    MIN_QUANTIZED_VECTORS,
+    chroma_report,
+    current_report,
+    ensure_index,
+    get_retriever,
+    load_index,
+)
+from vector_store import open_collection
+
+faiss = pytest.importorskip("faiss")
+
+
+def clustered(count, dimensions=32, clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimensions))
+    vectors = centres[rng.integers(0, clusters, count)] + 0.3 * rng.standard_normal((count, dimensions))
+    return vectors.astype(np.float32)
+
+
+def collection(tmp_path, vectors, name="faiss_test"):
+    vectorstore = open_collection(name, DeterministicFakeEmbedding(size=vectors.shape[1]), str(tmp_path))
+    for start in range(0, len(vectors), 5000):
+        rows = range(start, min(start + 5000, len(vectors)))
+        vectorstore._collection.add(
+            ids=[f"c{row}" for row in rows],
+            embeddings=vectors[start:start + 5000].tolist(),
+            documents=[f"chunk {row}" for row in rows],
+        )
+    return vectorstore
+
+
+def test_small_collections_fall_back_to_exact_search(tmp_path):
+    vectorstore = collection(tmp_path, clustered(200))
+    retriever, report = get_retriever(vectorstore, vectorstore.embeddings, "faiss_test", "faiss-ivfpq", "set1", persist_directory=str(tmp_path))
+
+    assert report["factory"] == "Flat" and "fallback" in report
+    assert report["recall_at_k"] == 1.0
+    assert len(retriever.invoke("chunk 3")) == 3
+
+
+def test_ivf_probes_enough_lists_for_recall_and_reloads_with_them(tmp_path):
+    vectorstore = collection(tmp_path, clustered(MIN_QUANTIZED_VECTORS + 100))
+    report = ensure_index(vectorstore, "faiss_test", "faiss-ivfsq8", "set1", str(tmp_path))
+
+    assert report["factory"].startswith("IVF")
+    assert report["recall_at_k"] >= 0.9
+    index, chunk_ids = load_index("faiss_test", "faiss-ivfsq8", str(tmp_path))
+    assert faiss.extract_index_ivf(index).nprobe == report["nprobe"]
+    # The chunk IDs are memory-mapped, and the mapping is reused until the index is rebuilt
+    assert isinstance(chunk_ids, np.memmap)
+    assert load_index("faiss_test", "faiss-ivfsq8", str(tmp_path))[0] is index
+
+
+def test_reports_are_tied_to_the_document_set(tmp_path):
+    vectorstore = collection(tmp_path, clustered(300))
+    report = chroma_report(vectorstore, "faiss_test", "set1", str(tmp_path))
+
+    assert report["build_seconds"] is None and report["index_bytes"] > report["raw_vector_bytes"]
+    assert report["recall_at_k"] >= 0.9
+    assert current_report("faiss_test", "chroma", "set1", str(tmp_path)) == report
+    assert current_report("faiss_test", "chroma", "set2", str(tmp_path)) is None
+    assert current_report("faiss_test", "faiss-flat", "set1", str(tmp_path)) is None
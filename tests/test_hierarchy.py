@@ -0,0 +1,75 @@
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from dedup import section_key
+from hierarchy import SECTION_PAGES, document_filter, get_retriever, section_filter, summary_path, update_summaries
+from index_manager import IndexManager
+from ingestion import content_hash
+from test_index_manager import fake_ingest, upload, words
+
+
+def test_filters_grow_with_files_and_sections_not_chunks():
+    assert document_filter([]) is None
+    assert document_filter(["a"]) == {section_key("a"): {"$gte": 0}}
+    assert document_filter(["a", "b", "a"]) == {"$or": [{section_key("a"): {"$gte": 0}}, {section_key("b"): {"$gte": 0}}]}
+
+    assert section_filter([]) is None
+    assert section_filter([("a", 0), ("b", 2), ("a", 3)]) == {"$or": [
+        {section_key("a"): {"$in": [0, 3]}}, {section_key("b"): {"$in": [2]}}
+    ]}
+
+
+def stored_pages(vectorstore, where):
+    found = vectorstore.get(where=where, include=["metadatas"])["metadatas"]
+    return sorted((metadata["source"], metadata["page"]) for metadata in found)
+
+
+def test_document_filter_finds_chunks_collapsed_into_another_file(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = IndexManager("hierarchy_shared", embeddings, str(tmp_path))
+    ingest = fake_ingest(embeddings)
+    a = upload("a.pdf", words("a"), words("appendix"))
+    b = upload("b.pdf", words("b"), words("appendix"))
+    index.sync([a, b], ingest)
+
+    # The appendix is stored once, for a.pdf, but still belongs to b.pdf
+    assert stored_pages(index.vectorstore, document_filter([content_hash(b[1])])) == [("a.pdf", 1), ("b.pdf", 0)]
+
+    index.sync([b], ingest)
+    assert stored_pages(index.vectorstore, document_filter([content_hash(a[1])])) == []
+    assert stored_pages(index.vectorstore, document_filter([content_hash(b[1])])) == [("b.pdf", 0), ("b.pdf", 1)]
+
+
+def test_retriever_searches_only_the_selected_sections(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = IndexManager("hierarchy_sections", embeddings, str(tmp_path))
+    pages = [words(f"p{page}x") for page in range(3 * SECTION_PAGES)]
+    index.sync([upload("long.pdf", *pages)], fake_ingest(embeddings))
+
+    retriever, summaries = get_retriever(
+        index.vectorstore, embeddings, index.name, index.files, sections=1, k=50, persist_directory=str(tmp_path)
+    )
+    assert summaries.documents == 1 and summaries.section_count == 3
+    found = retriever.invoke(pages[SECTION_PAGES + 2])
+    assert len(found) == SECTION_PAGES
+    assert len({metadata["page"] // SECTION_PAGES for metadata in (doc.metadata for doc in found)}) == 1
+
+
+def test_summaries_from_older_versions_are_rebuilt_and_chunks_tagged(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = IndexManager("hierarchy_legacy", embeddings, str(tmp_path))
+    a = upload("a.pdf", *[words(f"p{page}x") for page in range(SECTION_PAGES + 1)])
+    index.sync([a], fake_ingest(embeddings))
+    file_hash = content_hash(a[1])
+    key = section_key(file_hash)
+
+    # As written before chunks recorded their sections
+    stored = index.vectorstore.get(include=[])["ids"]
+    index.vectorstore._collection.update(ids=stored, metadatas=[{key: None}] * len(stored))
+    np.savez(summary_path(index.name, str(tmp_path)), file_hashes=np.array([file_hash]), member_ids=np.array(["x"]))
+    assert stored_pages(index.vectorstore, document_filter([file_hash])) == []
+
+    summaries = update_summaries(index.vectorstore, index.name, index.files, persist_directory=str(tmp_path))
+    assert summaries.section_count == 2
+    assert len(stored_pages(index.vectorstore, section_filter([(file_hash, 1)]))) == 1
+    assert len(stored_pages(index.vectorstore, document_filter([file_hash]))) == SECTION_PAGES + 1
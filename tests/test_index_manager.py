@@ -0,0 +1,80 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from index_manager import IndexManager
+from ingestion import IngestedFile, content_hash, split_pages
+
+
+def upload(name, *pages):
+    return name, "|".join(pages).encode("utf-8")
+
+
+def words(prefix, count=60):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def fake_ingest(embeddings, calls=None):
+    """Ingest function splitting an upload into one chunk per "|"-separated page."""
+    def ingest(uploads):
+        ingested = []
+        for name, data in uploads:
+            if calls is not None:
+                calls.append(name)
+            file_hash = content_hash(data)
+            pages = [
+                Document(page_content=text, metadata={"source": name, "page": page})
+                for page, text in enumerate(data.decode("utf-8").split("|"))
+            ]
+            chunks = split_pages(file_hash, pages)
+            vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+            ingested.append(IngestedFile(name=name, file_hash=file_hash, chunks=chunks, vectors=vectors))
+        return ingested, []
+    return ingest
+
+
+def test_sync_only_ingests_added_files_and_deletes_removed_ones(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = IndexManager("index_test", embeddings, str(tmp_path))
+    calls = []
+    ingest = fake_ingest(embeddings, calls)
+    a = upload("a.pdf", words("a"), words("aa"))
+    b = upload("b.pdf", words("b"))
+
+    delta, errors = index.sync([a, b], ingest)
+    assert errors == [] and len(delta.added) == 2
+    assert index.vectorstore._collection.count() == 3
+
+    delta, _ = index.sync([a, b], ingest)
+    assert not delta.changed
+    assert calls == ["a.pdf", "b.pdf"]
+
+    delta, _ = index.sync([b], ingest)
+    assert delta.removed == [content_hash(a[1])]
+    assert calls == ["a.pdf", "b.pdf"]
+    assert index.vectorstore._collection.count() == 1
+    assert list(index.files) == [content_hash(b[1])]
+
+    index.sync([], ingest)
+    assert index.vectorstore._collection.count() == 0
+    assert index.files == {}
+
+
+def test_sync_stores_shared_chunks_once_and_releases_them_per_file(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = IndexManager("index_shared", embeddings, str(tmp_path))
+    ingest = fake_ingest(embeddings)
+    a = upload("a.pdf", words("a"), words("appendix"))
+    b = upload("b.pdf", words("b"), words("appendix"))
+
+    delta, errors = index.sync([a, b], ingest)
+    assert errors == [] and len(delta.added) == 2
+    # The shared appendix is stored once and referenced by both files
+    assert index.vectorstore._collection.count() == 3
+    assert sorted(index.refcounts.values()) == [1, 1, 2]
+
+    delta, _ = index.sync([b], ingest)
+    assert delta.removed == [content_hash(a[1])]
+    assert index.vectorstore._collection.count() == 2
+    assert sorted(index.refcounts.values()) == [1, 1]
+    stored = index.vectorstore.get(include=["metadatas"])["metadatas"]
+    assert {metadata["source"] for metadata in stored} == {"b.pdf"}
@@ -0,0 +1,49 @@
+from multiprocessing import shared_memory
+
+import pytest
+
+import ingestion
+from benchmark import synthetic_pdf
+from ingestion import extract_files, extraction_pool_started, get_extraction_pool, iter_page_ranges
+
+
+def page_numbers(pages):
+    return [page.metadata["page"] for page in pages]
+
+
+def test_single_small_upload_is_extracted_without_starting_the_pool(monkeypatch):
+    monkeypatch.setattr(ingestion, "_pool", None)
+    pages, errors = extract_files([("small.pdf", synthetic_pdf(12))], max_workers=4, pages_per_task=5)
+
+    assert errors == {} and page_numbers(pages[0]) == list(range(12))
+    assert not extraction_pool_started()
+
+
+def test_parallel_extraction_keeps_order_and_shares_one_pool():
+    files = [("a.pdf", synthetic_pdf(12, seed=1)), ("broken.pdf", b"not a pdf"), ("b.pdf", synthetic_pdf(7, seed=2))]
+    progress = []
+
+    pages, errors = extract_files(files, max_workers=2, pages_per_task=5, on_progress=lambda done, total, name: progress.append(name))
+    assert page_numbers(pages[0]) == list(range(12)) and page_numbers(pages[2]) == list(range(7))
+    assert list(errors) == [1]
+    assert sorted(progress) == ["a.pdf", "b.pdf"]
+
+    # Calls asking for different worker counts use the same pool
+    pool = get_extraction_pool()
+    pages, errors = extract_files(files[:1], max_workers=3, pages_per_task=4)
+    assert page_numbers(pages[0]) == list(range(12))
+    assert get_extraction_pool() is pool
+
+
+def test_streamed_ranges_arrive_in_order_and_release_shared_memory(monkeypatch):
+    shared = []
+    share = ingestion._share
+    monkeypatch.setattr(ingestion, "_share", lambda data: shared.append(share(data)) or shared[-1])
+
+    ranges = list(iter_page_ranges("big.pdf", synthetic_pdf(23), 23, max_workers=2, pages_per_task=5))
+    assert [page_numbers(pages) for pages in ranges] == [list(range(start, min(start + 5, 23))) for start in range(0, 23, 5)]
+
+    # One segment for the whole file, unlinked once the ranges are read
+    assert len(shared) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared[0].name)
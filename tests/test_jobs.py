@@ -0,0 +1,45 @@
+import threading
+
+from jobs import CANCELLED, DONE, JobManager
+
+
+def wait(job, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if not job.active:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"{job.id} still {job.state}")
+
+
+def test_submit_returns_active_job_for_same_key():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+    first = manager.submit("key", lambda job: release.wait(5) and "done")
+    second = manager.submit("key", lambda job: "other")
+    release.set()
+    wait(first)
+
+    assert second is first
+    assert first.state == DONE and first.result == "done"
+
+
+def test_group_submit_and_cancel_stop_jobs_at_next_check():
+    manager = JobManager(max_workers=2)
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.report(0.5)
+            threading.Event().wait(0.01)
+
+    superseded = manager.submit("a", work, group="session")
+    started.wait(5)
+    replacement = manager.submit("b", work, group="session")
+    wait(superseded)
+
+    assert superseded.state == CANCELLED
+    assert manager.cancel(replacement.id)
+    wait(replacement)
+    assert replacement.state == CANCELLED
+    assert not manager.cancel(replacement.id)
@@ -0,0 +1,46 @@
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from context import count_message_tokens
+from memory import SUMMARY_BATCH_MESSAGES, WindowedChatHistory, build_summarizer
+
+
+def turn(number):
+    return [HumanMessage(f"Question {number}: " + "detail " * 20), AIMessage(f"Answer {number}: " + "fact " * 20)]
+
+
+def test_window_keeps_recent_turns_within_budget_starting_on_a_question():
+    budget = count_message_tokens(turn(0)) * 2 + 10
+    history = WindowedChatHistory(InMemoryChatMessageHistory(), max_tokens=budget)
+    for number in range(5):
+        history.add_messages(turn(number))
+
+    window = history.messages
+    assert [message.content.split(":")[0] for message in window] == ["Question 3", "Answer 3", "Question 4", "Answer 4"]
+    assert count_message_tokens(window) <= budget
+    assert len(history.transcript) == 10
+
+
+def test_messages_get_ids_and_escaped_html_once_stored():
+    history = WindowedChatHistory(InMemoryChatMessageHistory())
+    history.add_messages([HumanMessage("<b>bold</b>\nnext")])
+
+    stored = history.store.messages[0]
+    assert stored.id
+    assert stored.additional_kwargs["html"] == "&lt;b&gt;bold&lt;/b&gt;<br>next"
+
+
+def test_older_turns_are_folded_into_a_rolling_summary():
+    summarizer = build_summarizer(FakeListChatModel(responses=["Earlier: questions 0 to 2."]))
+    budget = count_message_tokens(turn(0)) + 10
+    history = WindowedChatHistory(InMemoryChatMessageHistory(), max_tokens=budget, summarizer=summarizer)
+    for number in range(1 + SUMMARY_BATCH_MESSAGES // 2):
+        history.add_messages(turn(number))
+
+    window = history.messages
+    assert isinstance(window[0], SystemMessage)
+    assert window[0].content == "Summary of the earlier conversation: Earlier: questions 0 to 2."
+    assert [message.content.split(":")[0] for message in window[1:]] == ["Question 2", "Answer 2"]
+    # The summary is stored but never shown in the transcript
+    assert len(history.transcript) == 6
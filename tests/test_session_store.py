@@ -0,0 +1,50 @@
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from session_store import SQLiteChatMessageHistory, get_connection
+
+
+def test_histories_persist_per_session_and_clear(tmp_path):
+    database = str(tmp_path / "sessions.db")
+    first = SQLiteChatMessageHistory("first", database)
+    first.add_messages([HumanMessage("hello", id="1"), AIMessage("hi", id="2")])
+    SQLiteChatMessageHistory("second", database).add_messages([HumanMessage("other")])
+
+    reopened = SQLiteChatMessageHistory("first", database)
+    assert [(message.type, message.content, message.id) for message in reopened.messages] == [
+        ("human", "hello", "1"), ("ai", "hi", "2")
+    ]
+    assert reopened.count() == 2
+
+    reopened.clear()
+    assert reopened.messages == [] and reopened.count() == 0
+    assert SQLiteChatMessageHistory("second", database).count() == 1
+
+
+def test_count_and_latest_reach_past_the_loaded_window(tmp_path):
+    database = str(tmp_path / "sessions.db")
+    history = SQLiteChatMessageHistory("long", database, recent_messages=4)
+    history.add_messages([HumanMessage(str(number)) for number in range(10)])
+
+    assert [message.content for message in history.messages] == ["6", "7", "8", "9"]
+    assert history.count() == 10
+    assert [message.content for message in history.latest(7)] == [str(number) for number in range(3, 10)]
+
+
+def test_database_uses_wal_and_accepts_concurrent_writers(tmp_path):
+    database = str(tmp_path / "sessions.db")
+    assert get_connection(database).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def write(writer):
+        history = SQLiteChatMessageHistory("shared", database)
+        for number in range(20):
+            history.add_messages([HumanMessage(f"{writer}-{number}")])
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert SQLiteChatMessageHistory("shared", database).count() == 80
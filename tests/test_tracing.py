@@ -0,0 +1,32 @@
+import logging
+import socket
+import urllib.request
+
+import tracing
+from tracing import serve_metrics, span
+
+
+def test_port_zero_binds_a_free_port_and_logs_it(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "_server", None)
+    with span("test_stage"):
+        pass
+
+    with caplog.at_level(logging.INFO, logger="tracing"):
+        port = serve_metrics(0)
+    assert port and f":{port}/metrics" in caplog.text
+    # Later calls in the same process reuse the running server
+    assert serve_metrics(0) == port
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert 'rag_stage_seconds_count{stage="test_stage"}' in response.read().decode("utf-8")
+    tracing._server.shutdown()
+
+
+def test_taken_port_is_logged_and_disabled_port_is_skipped(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "_server", None)
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        with caplog.at_level(logging.WARNING, logger="tracing"):
+            assert serve_metrics(taken.getsockname()[1]) is None
+    assert "Metrics server not started" in caplog.text
+    assert serve_metrics(None) is None and tracing._server is None
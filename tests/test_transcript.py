@@ -0,0 +1,33 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from transcript import TranscriptRenderer, add_html, escape_content
+
+AUTHORS = {"human": "Ana <admin>", "ai": "AI Analyst"}
+
+
+def test_escape_content_escapes_markup_and_keeps_line_breaks():
+    assert escape_content("<script>alert('x')</script>\nok") == "&lt;script&gt;alert(&#x27;x&#x27;)&lt;/script&gt;<br>ok"
+
+
+def test_add_html_escapes_once():
+    message = add_html(HumanMessage("a < b"))
+    message.additional_kwargs["html"] = "kept"
+    assert add_html(message).additional_kwargs["html"] == "kept"
+
+
+def test_render_escapes_authors_and_legacy_messages_and_caches_by_id():
+    renderer = TranscriptRenderer(max_entries=2)
+    stored = add_html(HumanMessage("<i>question</i>", id="1"))
+    legacy = AIMessage("<b>answer</b>", id="2")
+
+    html = renderer.render([stored, legacy], AUTHORS)
+    assert "<strong>Ana &lt;admin&gt;</strong>" in html
+    assert "&lt;i&gt;question&lt;/i&gt;" in html and "&lt;b&gt;answer&lt;/b&gt;" in html
+    assert (renderer.hits, renderer.misses) == (0, 2)
+
+    assert renderer.render([stored, legacy], AUTHORS) == html
+    assert (renderer.hits, renderer.misses) == (2, 2)
+
+    renderer.render([AIMessage("new", id="3")], AUTHORS)
+    renderer.render([stored], AUTHORS)
+    assert renderer.misses == 4
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from vector_store import IN_USE_SECONDS, get_client, open_collection, prune_collections, touch_collection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def age(directory, **ages):
+    """Backdate collections' last use by the given number of seconds."""
+    path = os.path.join(directory, "collections.json")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    for name, seconds in ages.items():
+        manifest[name] = time.time() - seconds
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def test_prune_keeps_recent_and_in_use_collections(tmp_path):
+    directory = str(tmp_path)
+    embeddings = DeterministicFakeEmbedding(size=8)
+    for name in ("newest", "busy", "recent", "stale"):
+        open_collection(name, embeddings, directory).add_texts([name])
+        touch_collection(name, directory)
+    old = IN_USE_SECONDS + 60
+    age(directory, newest=0, recent=IN_USE_SECONDS // 2, busy=old, stale=old + 1)
+
+    assert prune_collections(directory, keep=1, in_use=["busy"]) == ["stale"]
+    names = {collection.name for collection in get_client(directory).list_collections()}
+    assert names == {"newest", "busy", "recent"}
+
+
+def test_touches_from_other_processes_are_not_lost(tmp_path):
+    script = "import sys; from vector_store import touch_collection; touch_collection(sys.argv[1], sys.argv[2])"
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script, f"collection{number}", str(tmp_path)], cwd=ROOT)
+        for number in range(4)
+    ]
+    for process in processes:
+        assert process.wait() == 0
+
+    with open(tmp_path / "collections.json", encoding="utf-8") as f:
+        assert sorted(json.load(f)) == [f"collection{number}" for number in range(4)]
@@ -0,0 +1,323 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from answer_cache import ANSWER_CACHE_SKIPPED_EVENT
+from chat import REWRITE_SKIPPED_EVENT
+
+# Per-stage timings for ingestion and chat turns. Spans go to a JSONL trace
+# file and into process-wide Prometheus metrics served on METRICS_HOST and
+# METRICS_PORT. The default host only accepts local scrapers; set it to
+# 0.0.0.0 to expose the metrics on every interface. Replicas on one host
+# each need their own METRICS_PORT, or 0 to bind any free port, which is
+# logged; "off" disables the endpoint.
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces.jsonl")
+TRACE_MAX_BYTES = 50 * 1024 * 1024
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+_metrics_port = os.getenv("METRICS_PORT", "9464")
+METRICS_PORT: Optional[int] = None if _metrics_port.lower() == "off" else int(_metrics_port)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Chat pipeline runs, by LangChain run name, and the stage each one is reported as
+CHAIN_STAGES = {
+    "chat_retriever_chain": "history_aware_retriever",
+    "rewrite_question": "question_rewrite",
+    # create_retrieval_chain renames the retriever it wraps
+    "retrieve_documents": "retrieval",
+    "cached_answer": "question_answer_chain",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Minimal Prometheus registry: per-stage latency histograms and labelled counters."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, List[float]] = {}
+        self._sums: Dict[str, float] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            counts = self._histograms.setdefault(stage, [0] * (len(self.buckets) + 1))
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[position] += 1
+            counts[-1] += 1
+            self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """Total seconds observed so far per stage."""
+        with self._lock:
+            return dict(self._sums)
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP rag_stage_seconds Duration of pipeline stages.",
+            "# TYPE rag_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, counts in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {self._sums[stage]:.6f}')
+                lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {counts[-1]}')
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in declared:
+                    lines.append(f"# TYPE {name} counter")
+                    declared.add(name)
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+_trace_lock = threading.Lock()
+
+
+def write_trace(record: dict, path: str = TRACE_FILE) -> None:
+    """Append one JSON line to the trace file, rotating it to ``<path>.1`` when it grows too large."""
+    line = json.dumps(record, default=str) + "\n"
+    with _trace_lock:
+        try:
+            if os.path.getsize(path) > TRACE_MAX_BYTES:
+                os.replace(path, f"{path}.1")
+        except OSError:
+            pass
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+@contextmanager
+def span(stage: str, trace_id: Optional[str] = None, **attributes: Any):
+    """Time a block as one stage; yields a dict the block can add attributes to.
+
+    Numeric ``chunks`` and ``pages`` attributes are also counted in the metrics.
+    """
+    record = {"trace_id": trace_id or uuid.uuid4().hex, "stage": stage, "started": time.time(), **attributes}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 6)
+        metrics.observe(stage, record["seconds"])
+        for unit in ("chunks", "pages"):
+            if isinstance(record.get(unit), int):
+                metrics.increment(f"rag_{unit}_total", record[unit], stage=stage)
+        write_trace(record)
+
+
+@dataclass
+class StageTiming:
+    """One stage of a turn. ``cache`` is set for the rewrite and answer
+    stages: "hit" when they finished without calling the LLM, "miss" when
+    they called it, and "skip" when the rewrite or the cache was bypassed."""
+    stage: str
+    seconds: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    chunks: Optional[int] = None
+    cache: Optional[str] = None
+
+
+@dataclass
+class TurnTrace:
+    """Per-stage breakdown of one chat turn."""
+    trace_id: str
+    session_id: Optional[str]
+    total_seconds: float = 0.0
+    stages: List[StageTiming] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def seconds(self, stage: str) -> float:
+        return sum(timing.seconds for timing in self.stages if timing.stage == stage)
+
+    @property
+    def tokens(self) -> Tuple[int, int]:
+        return (
+            sum(timing.prompt_tokens for timing in self.stages if timing.stage == "llm"),
+            sum(timing.completion_tokens for timing in self.stages if timing.stage == "llm"),
+        )
+
+
+def _usage(response) -> Tuple[int, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class TurnTracer(BaseCallbackHandler):
+    """Callback handler that turns one chain invocation into a ``TurnTrace``.
+
+    Pass a fresh instance in the chain config for every turn. Named pipeline
+    runs (see ``CHAIN_STAGES``), retriever searches and LLM calls become
+    stages. A rewrite or answer stage that finished without an LLM call
+    underneath was served from its cache, unless it reported that it
+    bypassed the rewrite or the cache altogether. When the root run ends, the turn
+    is written to the trace file and recorded in the metrics.
+    """
+
+    run_inline = True
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.trace = TurnTrace(trace_id=uuid.uuid4().hex, session_id=session_id)
+        self._runs: Dict[UUID, dict] = {}
+        self._root: Optional[UUID] = None
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], stage: Optional[str]) -> None:
+        with self._lock:
+            if self._root is None:
+                self._root = run_id
+            self._runs[run_id] = {
+                "stage": stage, "parent": parent_run_id, "started": time.perf_counter(), "llm_calls": 0, "skipped": False
+            }
+
+    def _end(self, run_id: UUID, **details: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            if run is None:
+                return
+            seconds = time.perf_counter() - run["started"]
+            if run["stage"] is not None:
+                if run["stage"] in ("question_rewrite", "question_answer_chain"):
+                    details.setdefault("cache", "skip" if run["skipped"] else "miss" if run["llm_calls"] else "hit")
+                self.trace.stages.append(StageTiming(stage=run["stage"], seconds=round(seconds, 6), **details))
+            if run["stage"] == "llm":
+                # Credit the LLM call to every enclosing run still open
+                parent = run["parent"]
+                while parent in self._runs:
+                    self._runs[parent]["llm_calls"] += 1
+                    parent = self._runs[parent]["parent"]
+            finished = run_id == self._root
+        if finished:
+            self.trace.total_seconds = round(seconds, 6)
+            self._finish()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, CHAIN_STAGES.get(kwargs.get("name")))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        chunks = len(outputs) if isinstance(outputs, list) else None
+        self._end(run_id, **({"chunks": chunks} if chunks is not None else {}))
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        if run_id == self._root:
+            self.trace.error = f"{type(error).__name__}: {error}"
+        self._end(run_id)
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs) -> None:
+        if name in (REWRITE_SKIPPED_EVENT, ANSWER_CACHE_SKIPPED_EVENT):
+            with self._lock:
+                if run_id in self._runs:
+                    self._runs[run_id]["skipped"] = True
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, "vector_search")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs) -> None:
+        self._end(run_id, chunks=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        prompt_tokens, completion_tokens = _usage(response)
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def _finish(self) -> None:
+        metrics.increment("rag_turns_total", status="error" if self.trace.error else "ok")
+        metrics.observe("turn", self.trace.total_seconds)
+        for timing in self.trace.stages:
+            metrics.observe(timing.stage, timing.seconds)
+            if timing.stage == "llm":
+                metrics.increment("rag_tokens_total", timing.prompt_tokens, kind="prompt")
+                metrics.increment("rag_tokens_total", timing.completion_tokens, kind="completion")
+            if timing.cache is not None:
+                metrics.increment(
+                    "rag_cache_total",
+                    cache="rewrite" if timing.stage == "question_rewrite" else "answer",
+                    result=timing.cache
+                )
+        write_trace(dict(asdict(self.trace), stage="turn", started=time.time() - self.trace.total_seconds))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port: Optional[int] = METRICS_PORT, host: str = METRICS_HOST) -> Optional[int]:
+    """Serve ``/metrics`` on ``host:port`` from a daemon thread, once per process.
+
+    Port 0 binds any free port. Returns the bound port, or None when disabled
+    (port None) or when binding failed, e.g. because another replica on the
+    same host holds the port; both outcomes are logged.
+    """
+    global _server
+    with _server_lock:
+        if _server is None and port is not None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                logger.warning(
+                    "Metrics server not started on %s:%s: %s. Give each replica its own METRICS_PORT, or 0 for any free port.",
+                    host, port, e
+                )
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            logger.info("Serving metrics on http://%s:%s/metrics", host, _server.server_address[1])
+        return _server.server_address[1] if _server is not None else None
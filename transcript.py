@@ -0,0 +1,75 @@
+import html
+import threading
+from collections import OrderedDict
+from typing import Dict, Sequence
+
+from langchain_core.messages import BaseMessage
+
+# The chat tab shows the most recent turns and loads older ones a page at a
+# time. Message bodies are escaped once, when the message is stored, and the
+# rendered block for each message is cached by message ID.
+TRANSCRIPT_TURNS = 20
+MAX_CACHED_MESSAGES = 2000
+
+MESSAGE_CLASSES = {"human": "chat-message-user", "ai": "chat-message-bot"}
+
+
+def escape_content(text: str) -> str:
+    """Message text as HTML: escaped, with line breaks kept."""
+    return html.escape(text).replace("\n", "<br>")
+
+
+def add_html(message: BaseMessage) -> BaseMessage:
+    """Store the escaped body in ``additional_kwargs["html"]`` so it is never escaped again."""
+    if "html" not in message.additional_kwargs and isinstance(message.content, str):
+        message.additional_kwargs["html"] = escape_content(message.content)
+    return message
+
+
+def message_block(css_class: str, author: str, body_html: str) -> str:
+    return f"<div class='{css_class}'><strong>{html.escape(author)}</strong><br>{body_html}</div>"
+
+
+class TranscriptRenderer:
+    """Builds the transcript HTML, reusing each message's block while it is unchanged.
+
+    Blocks are cached by message ID and author label, least recently used
+    first out beyond ``max_entries``. Messages stored before bodies were
+    escaped at write time are escaped here, once, on their first render.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_MESSAGES):
+        self.max_entries = max_entries
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def block(self, message: BaseMessage, authors: Dict[str, str]) -> str:
+        author = authors.get(message.type, message.type)
+        key = (message.id, author)
+        if message.id:
+            with self._lock:
+                cached = self._blocks.get(key)
+                if cached is not None:
+                    self._blocks.move_to_end(key)
+                    self.hits += 1
+                    return cached
+        body = message.additional_kwargs.get("html")
+        if body is None:
+            body = escape_content(message.content if isinstance(message.content, str) else str(message.content))
+        rendered = message_block(MESSAGE_CLASSES.get(message.type, "chat-message-bot"), author, body)
+        with self._lock:
+            self.misses += 1
+            if message.id:
+                self._blocks[key] = rendered
+                while len(self._blocks) > self.max_entries:
+                    self._blocks.popitem(last=False)
+        return rendered
+
+    def render(self, messages: Sequence[BaseMessage], authors: Dict[str, str]) -> str:
+        """One HTML fragment for ``messages``; ``authors`` maps message type to the displayed name."""
+        return "".join(self.block(message, authors) for message in messages)
+
+
+transcript_renderer = TranscriptRenderer()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from atomic_file import write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+PERSIST_DIRECTORY = "./chroma_db"
+MAX_COLLECTIONS = 20
+UPSERT_BATCH_SIZE = 1000
+# Collections used this recently are never pruned. Syncs touch their
+# collection when they start and open sessions every TOUCH_SECONDS.
+IN_USE_SECONDS = 3600
+TOUCH_SECONDS = 600
+
+_MANIFEST_NAME = "collections.json"
+_clients: Dict[str, "chromadb.ClientAPI"] = {}
+_lock = threading.Lock()
+
+
+def collection_name(file_hashes: Iterable[str], chunk_size: int, chunk_overlap: int, model_name: str) -> str:
+    """Name of the collection holding one document set under one set of ingestion settings."""
+    key = "|".join(sorted(set(file_hashes))) + f"|{chunk_size}|{chunk_overlap}|{model_name}"
+    return "pdf_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def workspace_collection(workspace: str, chunk_size: int, chunk_overlap: int, model_name: str) -> str:
+    """Name of the long-lived collection that is kept in sync with one workspace's uploads.
+
+    ``workspace`` should be stable across reloads, such as the session ID, so
+    a returning visitor finds their documents indexed. Everyone using the
+    same workspace shares one document set: syncing deletes every file that
+    is not in the current uploads.
+    """
+    key = f"{workspace}|{chunk_size}|{chunk_overlap}|{model_name}"
+    return "ws_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def index_manifest_path(name: str, persist_directory: str = PERSIST_DIRECTORY) -> str:
+    return os.path.join(persist_directory, f"{name}.index.json")
+
+
+def get_client(persist_directory: str = PERSIST_DIRECTORY):
+    path = os.path.abspath(persist_directory)
+    with _lock:
+        if path not in _clients:
+            os.makedirs(path, exist_ok=True)
+            _clients[path] = chromadb.PersistentClient(path=path)
+        return _clients[path]
+
+
+def _read_manifest(persist_directory: str) -> Dict[str, float]:
+    try:
+        with open(os.path.join(persist_directory, _MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(persist_directory: str, manifest: Dict[str, float]) -> None:
+    write_json(os.path.join(persist_directory, _MANIFEST_NAME), manifest)
+
+
+@contextmanager
+def _manifest_lock(persist_directory: str):
+    """Serialise manifest updates and pruning across threads and app processes."""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(persist_directory, exist_ok=True)
+        with open(os.path.join(persist_directory, f"{_MANIFEST_NAME}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def prune_collections(
+    persist_directory: str = PERSIST_DIRECTORY, keep: int = MAX_COLLECTIONS, in_use: Iterable[str] = ()
+) -> List[str]:
+    """Drop the least recently used collections beyond ``keep`` to bound disk use.
+
+    Collections in ``in_use`` or used within IN_USE_SECONDS are kept even
+    beyond ``keep``.
+    """
+    client = get_client(persist_directory)
+    in_use = set(in_use)
+    with _manifest_lock(persist_directory):
+        manifest = _read_manifest(persist_directory)
+        cutoff = time.time() - IN_USE_SECONDS
+        stale = [
+            name for name in sorted(manifest, key=manifest.get, reverse=True)[keep:]
+            if name not in in_use and manifest[name] < cutoff
+        ]
+        for name in stale:
+            try:
+                client.delete_collection(name)
+            except Exception:
+                pass
+            # Index manifests and derived indexes are all named "<collection>.*"
+            for file_name in os.listdir(persist_directory):
+                if file_name.startswith(f"{name}."):
+                    os.unlink(os.path.join(persist_directory, file_name))
+            manifest.pop(name, None)
+        _write_manifest(persist_directory, manifest)
+    return stale
+
+
+def touch_collection(name: str, persist_directory: str = PERSIST_DIRECTORY) -> None:
+    """Mark a collection as recently used, so pruning keeps it.
+
+    Callers touch a collection when a sync starts and every TOUCH_SECONDS
+    while a session uses it, not on every open.
+    """
+    with _manifest_lock(persist_directory):
+        manifest = _read_manifest(persist_directory)
+        manifest[name] = time.time()
+        _write_manifest(persist_directory, manifest)
+
+
+def open_collection(name: str, embeddings: Embeddings, persist_directory: str = PERSIST_DIRECTORY) -> Chroma:
+    """Open (or create) a persisted collection."""
+    return Chroma(
+        collection_name=name,
+        embedding_function=embeddings,
+        client=get_client(persist_directory),
+    )
+
+
+def upsert_chunks(vectorstore: Chroma, chunks: List[Document]) -> int:
+    """Add chunks whose ``chunk_id`` is not stored yet; returns how many were written."""
+    unique = {}
+    for chunk in chunks:
+        unique.setdefault(chunk.metadata["chunk_id"], chunk)
+    ids = list(unique)
+
+    existing = set()
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        existing.update(vectorstore.get(ids=ids[start:start + UPSERT_BATCH_SIZE], include=[])["ids"])
+
+    new_ids = [chunk_id for chunk_id in ids if chunk_id not in existing]
+    for start in range(0, len(new_ids), UPSERT_BATCH_SIZE):
+        batch = new_ids[start:start + UPSERT_BATCH_SIZE]
+        vectorstore.add_documents([unique[chunk_id] for chunk_id in batch], ids=batch)
+    return len(new_ids)
+
+
+def delete_chunks(vectorstore: Chroma, ids: List[str]) -> None:
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        vectorstore.delete(ids=ids[start:start + UPSERT_BATCH_SIZE])